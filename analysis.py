@@ -0,0 +1,255 @@
+import json
+import logging
+import time
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
+
+from bilkom_client import BilkomClient, StationMapper, NOT_IN_CONSIST
+
+if TYPE_CHECKING:
+    import numpy
+
+# Jednoliterowe kody statusów w zwartym formacie JSON
+STATUS_LETTERS = {
+    "AVAILABLE": "A",
+    "RESERVED": "R",
+    "BLOCKED": "B",
+    NOT_IN_CONSIST: "N"
+}
+
+# Kolejność statusów w macierzy kodów i w podsumowaniu wagonów
+STATUS_ORDER = ("AVAILABLE", "RESERVED", "BLOCKED", NOT_IN_CONSIST, "unknown")
+_STATUS_INDEX = {status.upper(): code for code, status in enumerate(STATUS_ORDER)}
+
+
+def seat_sort_key(seat):
+    wagon, number = seat.split('-')
+    return (int(wagon), int(number))
+
+
+def load_schema(client: BilkomClient, mapper: StationMapper, params: Dict) -> Tuple[Dict, str, str]:
+    """Pobiera SCHEMA pociągu: listę stacji, informacje o postojach i plany podróży wagonów."""
+    if not all([params['from_station'], params['to_station'], params['date'], params['train_number']]):
+        raise ValueError(f"Brak wymaganych parametrów w linku: {params}")
+    stations, stops, req, resp = client.get_train_stations(
+        params['from_station'],
+        params['to_station'],
+        params['train_number'],
+        params['date']
+    )
+    if len(stations) < 2:
+        raise ValueError("Za mało stacji na trasie!")
+
+    def get_station_name(epa_num):
+        return mapper.epa_to_name.get(epa_num, epa_num)
+
+    # Mapa EPA -> info o stacji
+    station_info = {}
+    for stop in stops:
+        epa = str(stop.get('stationNumber'))
+        station_info[epa] = {
+            'name': get_station_name(epa),
+            'code': epa,
+            'arrival': stop.get('plannedArrivalTime', ''),
+            'departure': stop.get('plannedDepartureTime', '')
+        }
+    first_epa = str(stops[0].get('stationNumber')) if len(stops) > 1 else params['from_station']
+    last_epa = str(stops[-1].get('stationNumber')) if len(stops) > 1 else params['to_station']
+    summary = {
+        'train_number': params['train_number'],
+        'from_station': first_epa,
+        'to_station': last_epa,
+        'from_station_name': get_station_name(first_epa),
+        'to_station_name': get_station_name(last_epa),
+        'date': params['date'],
+    }
+    try:
+        travel_plans = BilkomClient.parse_travel_plans(json.loads(resp))
+    except Exception as e:
+        logging.error(f"Błąd dekodowania JSON z odpowiedzi SCHEMA: {e}")
+        travel_plans = []
+    schema = {
+        'params': params,
+        'stations': stations,
+        'station_info': station_info,
+        'travel_plans': travel_plans,
+        'summary': summary
+    }
+    return schema, req, resp
+
+
+def slice_schema(schema: Dict, from_epa: Optional[str] = None, to_epa: Optional[str] = None) -> Dict:
+    """Zawęża trasę SCHEMA do odcinków między podanymi stacjami EPA."""
+    stations = schema['stations']
+    for name, epa in (('section_from', from_epa), ('section_to', to_epa)):
+        if epa and epa not in stations:
+            raise ValueError(f"Parametr {name}: stacji {epa} nie ma na trasie pociągu")
+    start = stations.index(from_epa) if from_epa else 0
+    end = stations.index(to_epa) if to_epa else len(stations) - 1
+    if end <= start:
+        raise ValueError(f"Niepoprawny zakres odcinków: {from_epa} -> {to_epa}")
+    # Pełna trasa zostaje w 'route' - plany wagonów odnoszą się do całego przejazdu
+    return dict(schema, stations=stations[start:end + 1], route=schema.get('route', stations))
+
+
+def plan_schema_sections(schema: Dict, selected_wagons=None) -> List[Dict]:
+    """Plan odcinków SCHEMA (BilkomClient.plan_sections), także dla trasy zawężonej przez slice_schema.
+
+    Plan liczony jest dla całej trasy i dopiero potem przycinany, żeby wagony
+    jadące tylko poza zakresem nie były traktowane jak jadące całą trasą.
+    """
+    route = schema.get('route', schema['stations'])
+    plan = BilkomClient.plan_sections(route, schema['travel_plans'], selected_wagons)
+    start = route.index(schema['stations'][0])
+    return plan[start:start + len(schema['stations']) - 1]
+
+
+def run_analysis(client: BilkomClient, schema: Dict, selected_wagons=None,
+                 on_section: Optional[Callable] = None) -> Dict:
+    """Pobiera statusy miejsc dla odcinków trasy wg planu wagonów.
+
+    on_section(done, total, col_name, request) jest wywoływane po każdym
+    pobranym odcinku (request=None dla odcinka pominiętego).
+    """
+    params = schema['params']
+    station_info = schema['station_info']
+    plan = plan_schema_sections(schema, selected_wagons)
+    fetch_count = sum(1 for section in plan if section['wagons'] != [])
+    results = {}  # {kolumna: {wagon-miejsce: status}}
+    all_seats = set()
+    seat_properties = {}  # seat_key -> properties
+    wagons_with_props = set()
+    oldest_response = None  # czas pobrania najstarszej użytej odpowiedzi (mogła przyjść z cache)
+    done = 0
+    for section in plan:
+        from_epa = section['from']
+        to_epa = section['to']
+        col_name = f"{from_epa}-{to_epa}"
+        if section['wagons'] == []:
+            # Żaden wybrany wagon tu nie jedzie - nie pytamy API
+            results[col_name] = {}
+            if on_section:
+                on_section(done, fetch_count, col_name, None)
+            continue
+        seat_status, req, resp = client.get_carriages_for_section(
+            from_epa,
+            to_epa,
+            params['train_number'],
+            params['date']
+        )
+        response_at = client.last_response_at or time.time()
+        oldest_response = response_at if oldest_response is None else min(oldest_response, response_at)
+        running = set(section['wagons']) if section['wagons'] is not None else None
+        if running is not None:
+            seat_status = {seat: status for seat, status in seat_status.items() if seat.split('-')[0] in running}
+        results[col_name] = seat_status
+        all_seats.update(seat_status.keys())
+        # seat_properties zbieramy z pierwszego odcinka, w którym jedzie dany wagon
+        if running is None or not running <= wagons_with_props:
+            try:
+                carriages_json = json.loads(resp)
+                for carriage in carriages_json.get('carriages', []):
+                    wagon = str(carriage.get('carriageNumber'))
+                    if wagon in wagons_with_props or (running is not None and wagon not in running):
+                        continue
+                    wagons_with_props.add(wagon)
+                    for spot in carriage.get('spots', []):
+                        seat_key = f"{wagon}-{spot.get('number')}"
+                        seat_properties[seat_key] = spot.get('properties', [])
+            except Exception as e:
+                logging.error(f"Błąd dekodowania JSON z odpowiedzi CARRIAGE: {e}")
+        done += 1
+        if on_section:
+            on_section(done, fetch_count, col_name, req)
+    # Miejsca wagonów, które nie jadą na danym odcinku
+    for section in plan:
+        if section['wagons'] is None:
+            continue
+        running = set(section['wagons'])
+        section_status = results[f"{section['from']}-{section['to']}"]
+        for seat in all_seats:
+            if seat.split('-')[0] not in running:
+                section_status[seat] = NOT_IN_CONSIST
+    seats_sorted = sorted(all_seats, key=seat_sort_key)
+    all_wagons = sorted({seat.split('-')[0] for seat in seats_sorted}, key=int)
+    pretty_columns = []
+    for col in results.keys():
+        epa = col.split('-')[0]
+        info = station_info.get(epa, {'name': epa, 'code': epa, 'arrival': '', 'departure': ''})
+        pretty_columns.append(info)
+    analysis = {
+        'results': results,
+        'seats_sorted': seats_sorted,
+        'seat_properties': seat_properties,
+        'columns': pretty_columns,
+        'all_wagons': all_wagons,
+        'station_info': station_info,
+        'requests': fetch_count,
+        'fetched_at': oldest_response or time.time()
+    }
+    analysis['wagon_summary'] = summarize_wagons(analysis)
+    return analysis
+
+
+def status_matrix(analysis: Dict) -> "numpy.ndarray":
+    """Macierz kodów statusów (miejsca x odcinki) wg STATUS_ORDER."""
+    # numpy importowany dopiero tutaj - nie spowalnia startu aplikacji okienkowej
+    import numpy as np
+    seats = analysis['seats_sorted']
+    unknown = _STATUS_INDEX["UNKNOWN"]
+    matrix = np.full((len(seats), len(analysis['results'])), unknown, dtype=np.int8)
+    for col_idx, statuses in enumerate(analysis['results'].values()):
+        matrix[:, col_idx] = [_STATUS_INDEX.get(statuses.get(seat, "unknown").upper(), unknown) for seat in seats]
+    return matrix
+
+
+def summarize_wagons(analysis: Dict) -> Dict:
+    """Liczba miejsc w każdym statusie dla wagonu x odcinka, liczona jednym przebiegiem bincount.
+
+    'counts' ma kształt (wagony, odcinki, len(STATUS_ORDER)).
+    """
+    import numpy as np
+    wagons = analysis['all_wagons']
+    matrix = status_matrix(analysis)
+    wagon_index = {wagon: i for i, wagon in enumerate(wagons)}
+    seat_wagons = np.array([wagon_index[seat.split('-')[0]] for seat in analysis['seats_sorted']], dtype=np.int64)
+    n_sections = matrix.shape[1]
+    n_statuses = len(STATUS_ORDER)
+    # Płaski indeks (wagon, odcinek, status) dla każdej komórki tabeli
+    flat = (seat_wagons[:, None] * n_sections + np.arange(n_sections)[None, :]) * n_statuses + matrix
+    counts = np.bincount(flat.ravel(), minlength=len(wagons) * n_sections * n_statuses)
+    return {
+        'wagons': wagons,
+        'sections': list(analysis['results'].keys()),
+        'counts': counts.reshape(len(wagons), n_sections, n_statuses)
+    }
+
+
+def free_seats(analysis: Dict) -> List[str]:
+    """Miejsca wolne (AVAILABLE) na wszystkich odcinkach analizy."""
+    sections = list(analysis['results'].values())
+    return [
+        seat for seat in analysis['seats_sorted']
+        if all(section.get(seat, "unknown").upper() == "AVAILABLE" for section in sections)
+    ]
+
+
+def to_compact_json(analysis: Dict, summary: Optional[Dict] = None) -> Dict:
+    """Zwarta reprezentacja wyniku: jeden ciąg liter statusów na miejsce (kolejność jak 'sections')."""
+    sections = list(analysis['results'].keys())
+    section_statuses = list(analysis['results'].values())
+    seats = {}
+    for seat in analysis['seats_sorted']:
+        seats[seat] = "".join(
+            STATUS_LETTERS.get(statuses.get(seat, "unknown").upper(), "?") for statuses in section_statuses
+        )
+    # Stacje trasy: początki kolejnych odcinków i koniec ostatniego (len(sections) + 1)
+    station_codes = [col.split('-')[0] for col in sections] + [sections[-1].split('-')[1]] if sections else []
+    legend = {letter: status for status, letter in STATUS_LETTERS.items()}
+    legend["?"] = "unknown"
+    return {
+        'summary': summary,
+        'sections': sections,
+        'stations': [analysis['station_info'].get(epa, {}).get('name', epa) for epa in station_codes],
+        'legend': legend,
+        'seats': seats
+    }
@@ -0,0 +1,305 @@
+import argparse
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Optional
+from urllib.parse import urlparse, parse_qs
+
+from bilkom_client import BilkomClient, StationMapper, GrmResponseCache, DEFAULT_GRM_CACHE_MB
+from analysis import load_schema, slice_schema, run_analysis, free_seats, to_compact_json
+from result_store import ResultStore, get_result_store, make_analysis_id
+from date_scan import scan_dates
+from prefetch import PrefetchScheduler
+
+logging.basicConfig(filename='app.log', level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+
+# Maksymalny rozmiar treści zapytania POST (B)
+MAX_BODY_BYTES = 64 * 1024
+
+
+class AnalysisService:
+    """Wspólny, "ciepły" proces analizy: pula wątków, cache odpowiedzi i limity czasu.
+
+    Dane SCHEMA i wyniki analiz trzymane są w magazynie wyników (ResultStore)
+    z czasem ważności cache_ttl; identyczne zapytania w toku są łączone.
+    """
+
+    def __init__(self, workers: int = 4, timeout: float = 30.0, cache_ttl: float = 60.0,
+                 store: Optional[ResultStore] = None, prefetch: Optional[PrefetchScheduler] = None):
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self.store = store or get_result_store()
+        # Planista rozgrzewający cache /grm popularnych pociągów (opcjonalny)
+        self.prefetch = prefetch
+        self.station_mapper = StationMapper()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="grm-worker")
+        self.workers = workers
+        self._local = threading.local()
+        self._inflight = {}  # klucz -> Future
+        self._lock = threading.Lock()
+
+    @property
+    def client(self) -> BilkomClient:
+        # Osobny klient (sesja HTTP) dla każdego wątku roboczego
+        if not hasattr(self._local, 'client'):
+            if self.prefetch is not None:
+                self._local.client = self.prefetch.make_client(timeout=self.timeout)
+            else:
+                self._local.client = BilkomClient(timeout=self.timeout)
+        return self._local.client
+
+    def _cached(self, key: str) -> Optional[Dict]:
+        entry = self.store.get(key)
+        if entry is not None and time.time() - entry['created'] < self.cache_ttl:
+            return entry['value']
+        return None
+
+    def _load(self, key: str, loader: Callable):
+        """Zwraca wartość z cache albo wylicza ją w wątku wywołującym i zapisuje."""
+        value = self._cached(key)
+        if value is None:
+            value = loader()
+            self.store.put(key, {'created': time.time(), 'value': value})
+        return value
+
+    def _submit(self, key: str, loader: Callable):
+        """Uruchamia zadanie w puli (łącząc identyczne zapytania) i czeka najwyżej self.timeout."""
+        value = self._cached(key)
+        if value is not None:
+            return value
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is None:
+                future = self.executor.submit(self._load, key, loader)
+                self._inflight[key] = future
+                future.add_done_callback(lambda f: self._forget(key, f))
+        return future.result(timeout=self.timeout)
+
+    def _forget(self, key, future):
+        with self._lock:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    def _schema(self, params: Dict) -> Dict:
+        key = make_analysis_id(params, kind="api-schema")
+        return self._load(key, lambda: load_schema(self.client, self.station_mapper, params)[0])
+
+    def _analysis(self, params: Dict, wagons=None, section_from=None, section_to=None) -> Dict:
+        def loader():
+            schema = slice_schema(self._schema(params), section_from, section_to)
+            return {'summary': schema['summary'], 'analysis': run_analysis(self.client, schema, wagons)}
+        key = make_analysis_id(params, wagons, kind="api-analysis", section_from=section_from, section_to=section_to)
+        return self._submit(key, loader)
+
+    def analyze(self, params: Dict, wagons=None, section_from=None, section_to=None) -> Dict:
+        data = self._analysis(params, wagons, section_from, section_to)
+        return to_compact_json(data['analysis'], data['summary'])
+
+    def free_seats(self, params: Dict, section_from: str, section_to: str, wagons=None) -> Dict:
+        data = self._analysis(params, wagons, section_from, section_to)
+        seats = free_seats(data['analysis'])
+        return {
+            'summary': data['summary'],
+            'from': section_from,
+            'to': section_to,
+            'count': len(seats),
+            'seats': seats
+        }
+
+    def scan(self, params: Dict, days: int, max_requests: int, wagons=None) -> Dict:
+        key = make_analysis_id(params, wagons, kind="api-scan", days=days, max_requests=max_requests)
+        return self._submit(key, lambda: scan_dates(
+            params, days, max_requests, selected_wagons=wagons, mapper=self.station_mapper, timeout=self.timeout
+        ))
+
+    def stats(self) -> Dict:
+        with self._lock:
+            inflight = len(self._inflight)
+        return {
+            'workers': self.workers,
+            'inflight': inflight,
+            'timeout': self.timeout,
+            'cache_ttl': self.cache_ttl,
+            'store': self.store.stats(),
+            'prefetch': self.prefetch.stats() if self.prefetch is not None else None
+        }
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    """GET z parametrami w query stringu lub POST z obiektem JSON (wygodniejsze dla linków BILKOM)."""
+
+    service: AnalysisService = None
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+        self._dispatch(parsed.path, query)
+
+    def do_POST(self):
+        parsed = urlparse(self.path)
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            self._send(400, {'error': "Niepoprawny nagłówek Content-Length"})
+            return
+        if not 0 <= length <= MAX_BODY_BYTES:
+            self._send(400, {'error': f"Content-Length musi być z zakresu 0-{MAX_BODY_BYTES}"})
+            return
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except (ValueError, json.JSONDecodeError) as e:
+            self._send(400, {'error': f"Niepoprawne dane JSON: {e}"})
+            return
+        if not isinstance(body, dict):
+            self._send(400, {'error': "Oczekiwano obiektu JSON z parametrami"})
+            return
+        query = {}
+        for key, value in body.items():
+            if value is None:
+                continue
+            if isinstance(value, (dict, list)) and key != 'wagons':
+                self._send(400, {'error': f"Parametr {key} musi być pojedynczą wartością"})
+                return
+            # Lista wagonów może przyjść jako tablica JSON
+            query[key] = value if isinstance(value, list) else str(value)
+        self._dispatch(parsed.path, query)
+
+    def _dispatch(self, path: str, query: Dict):
+        routes = {
+            '/analyze': self._analyze,
+            '/analyze/train': self._analyze,
+            '/free-seats': self._free_seats,
+            '/scan': self._scan,
+            '/stats': lambda q: self.service.stats(),
+            '/health': lambda q: {'status': 'ok'}
+        }
+        route = routes.get(path.rstrip('/') or '/')
+        if route is None:
+            self._send(404, {'error': f"Nieznany endpoint: {path}"})
+            return
+        try:
+            self._send(200, route(query))
+        except ValueError as e:
+            self._send(400, {'error': str(e)})
+        except FutureTimeout:
+            self._send(504, {'error': f"Przekroczono limit czasu ({self.service.timeout} s)"})
+        except Exception as e:
+            logging.error(f"API: błąd obsługi {path}: {e}")
+            self._send(502, {'error': str(e)})
+
+    def _params(self, query: Dict) -> Dict:
+        if query.get('link'):
+            params = BilkomClient().parse_url(query['link'])
+        else:
+            params = {
+                'from_station': query.get('from'),
+                'to_station': query.get('to'),
+                'date': query.get('date'),
+                'train_number': query.get('train')
+            }
+        if not all(params.values()):
+            raise ValueError(f"Brak wymaganych parametrów (link albo train/from/to/date): {params}")
+        return params
+
+    @staticmethod
+    def _wagons(query: Dict):
+        """Numery wagonów z listy JSON albo z tekstu rozdzielanego przecinkami."""
+        wagons = query.get('wagons')
+        if not wagons:
+            return None
+        if isinstance(wagons, str):
+            wagons = wagons.split(',')
+        selected = set()
+        for wagon in wagons:
+            wagon = str(wagon).strip()
+            if not wagon:
+                continue
+            if not wagon.isdigit():
+                raise ValueError(f"Niepoprawny numer wagonu: {wagon}")
+            selected.add(wagon)
+        return selected or None
+
+    @staticmethod
+    def _int(query: Dict, name: str, default: int) -> int:
+        try:
+            return int(query.get(name, default))
+        except ValueError:
+            raise ValueError(f"Parametr {name} musi być liczbą całkowitą")
+
+    def _analyze(self, query: Dict) -> Dict:
+        return self.service.analyze(
+            self._params(query),
+            self._wagons(query),
+            query.get('section_from'),
+            query.get('section_to')
+        )
+
+    def _free_seats(self, query: Dict) -> Dict:
+        if not query.get('section_from') or not query.get('section_to'):
+            raise ValueError("Wymagane parametry section_from i section_to (numery EPA)")
+        return self.service.free_seats(
+            self._params(query),
+            query['section_from'],
+            query['section_to'],
+            self._wagons(query)
+        )
+
+    def _scan(self, query: Dict) -> Dict:
+        days = self._int(query, 'days', 14)
+        max_requests = self._int(query, 'budget', 400)
+        if not 1 <= days <= 31:
+            raise ValueError("Parametr days musi być z zakresu 1-31")
+        if max_requests < 1:
+            raise ValueError("Parametr budget musi być dodatni")
+        return self.service.scan(self._params(query), days, max_requests, self._wagons(query))
+
+    def _send(self, code: int, payload: Dict):
+        body = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.info(f"API {self.address_string()} {format % args}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Usługa HTTP/JSON do analizy zajętości miejsc BILKOM GRM")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8502)
+    parser.add_argument('--workers', type=int, default=4, help="liczba wątków pobierających dane")
+    parser.add_argument('--timeout', type=float, default=30.0, help="limit czasu zapytania (s)")
+    parser.add_argument('--cache-ttl', type=float, default=60.0, help="czas ważności wyników w cache (s)")
+    parser.add_argument('--prefetch-budget', type=int, default=600,
+                        help="limit zapytań/h na rozgrzewanie popularnych pociągów (0 - wyłączone)")
+    parser.add_argument('--grm-cache-mb', type=float, default=DEFAULT_GRM_CACHE_MB,
+                        help="limit pamięci cache odpowiedzi /grm (MB)")
+    args = parser.parse_args()
+
+    prefetch = None
+    if args.prefetch_budget > 0:
+        # Rozgrzane odpowiedzi nie mogą być starsze niż wyniki trzymane przez usługę
+        prefetch = PrefetchScheduler(GrmResponseCache(int(args.grm_cache_mb * 1024 * 1024)),
+                                     max_requests_per_hour=args.prefetch_budget, timeout=args.timeout,
+                                     interactive_max_age=args.cache_ttl).start()
+    ApiHandler.service = AnalysisService(args.workers, args.timeout, args.cache_ttl, prefetch=prefetch)
+    server = ThreadingHTTPServer((args.host, args.port), ApiHandler)
+    print(f"API BILKOM GRM nasłuchuje na http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        ApiHandler.service.executor.shutdown(wait=False)
+        if prefetch is not None:
+            prefetch.stop()
+
+
+if __name__ == "__main__":
+    main()
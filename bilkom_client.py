@@ -5,10 +5,33 @@ import json
 from datetime import datetime
 import csv
 import os
+import threading
+import time
+from collections import OrderedDict
+
+from result_store import estimate_size
+
+# Status miejsca w odcinku, na którym jego wagon nie jedzie (wg travelPlan)
+NOT_IN_CONSIST = "NOT_IN_CONSIST"
+
+# Limit pamięci cache odpowiedzi /grm (MB), np. BILKOM_GRM_CACHE_MB=128
+DEFAULT_GRM_CACHE_MB = 64
 
 class BilkomClient:
-    def __init__(self):
-        self.session = requests.Session()
+    def __init__(self, timeout: float = None, cache: "GrmResponseCache" = None, usage_listener=None):
+        self._session = None
+        # Limit czasu pojedynczego zapytania (s); None - bez limitu
+        self.timeout = timeout
+        # Wspólny cache odpowiedzi /grm (np. rozgrzewany przez PrefetchScheduler)
+        self.cache = cache
+        self.cache_reads = True
+        self.cache_ttl = 60.0
+        # Najstarsza odpowiedź z cache akceptowana przy odczycie (s); None - do końca ważności wpisu
+        self.cache_max_age = None
+        # Czas pobrania z BILKOM ostatnio zwróconej odpowiedzi (także z cache)
+        self.last_response_at = None
+        # Wywoływane przy każdej analizie pociągu (pobranie SCHEMA) - statystyki popularności
+        self.usage_listener = usage_listener
         self.base_url = "https://bilkom.pl"
         self.headers = {
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
@@ -16,6 +39,31 @@ class BilkomClient:
             "Content-Type": "application/json"
         }
 
+    @property
+    def session(self) -> requests.Session:
+        # Sesja HTTP tworzona dopiero przy pierwszym zapytaniu
+        if self._session is None:
+            self._session = requests.Session()
+        return self._session
+
+    def _post_grm(self, payload: dict) -> Tuple[str, dict]:
+        """Wysyła zapytanie /grm i zwraca (tekst odpowiedzi, JSON), korzystając z cache, jeśli jest ustawiony."""
+        key = json.dumps(payload, sort_keys=True)
+        if self.cache is not None and self.cache_reads:
+            cached = self.cache.get(key, self.cache_max_age)
+            if cached is not None:
+                # W cache trzymany jest tylko tekst odpowiedzi - JSON odtwarzamy przy odczycie
+                self.last_response_at, resp_str = cached
+                return resp_str, json.loads(resp_str)
+        response = self.session.post(f"{self.base_url}/grm", json=payload, headers=self.headers, timeout=self.timeout)
+        resp_str = response.text
+        response.raise_for_status()
+        data = response.json()
+        self.last_response_at = time.time()
+        if self.cache is not None:
+            self.cache.put(key, resp_str, self.cache_ttl)
+        return resp_str, data
+
     def parse_url(self, url: str) -> Dict:
         parsed = urlparse(url)
         query_params = parse_qs(parsed.query)
@@ -38,6 +86,13 @@ class BilkomClient:
         return f"{year}-{month}-{day}T{hour}:{minute}:00"
 
     def get_train_stations(self, from_station: str, to_station: str, train_number: str, date: str) -> Tuple[List[str], list, str, str]:
+        if self.usage_listener is not None:
+            self.usage_listener({
+                'from_station': from_station,
+                'to_station': to_station,
+                'date': date,
+                'train_number': train_number
+            })
         try:
             payload = {
                 "stationFrom": int(from_station),
@@ -51,10 +106,7 @@ class BilkomClient:
                 "returnBGMRecordsInfo": False
             }
             req_str = json.dumps(payload, ensure_ascii=False, indent=2)
-            response = self.session.post(f"{self.base_url}/grm", json=payload, headers=self.headers)
-            resp_str = response.text
-            response.raise_for_status()
-            data = response.json()
+            resp_str, data = self._post_grm(payload)
             # Pobieramy epaNumber ze stops[]
             stops = data.get('stops', [])
             stations = [str(stop.get('stationNumber')) for stop in stops if stop.get('stationNumber')]
@@ -76,10 +128,7 @@ class BilkomClient:
                 "returnBGMRecordsInfo": False
             }
             req_str = json.dumps(payload, ensure_ascii=False, indent=2)
-            response = self.session.post(f"{self.base_url}/grm", json=payload, headers=self.headers)
-            resp_str = response.text
-            response.raise_for_status()
-            data = response.json()
+            resp_str, data = self._post_grm(payload)
             # Przetwarzanie miejsc
             seat_status = {}
             for carriage in data.get('carriages', []):
@@ -111,16 +160,7 @@ class BilkomClient:
             
             # Wykonanie zapytania
             req_str = json.dumps(payload, ensure_ascii=False, indent=2)
-            response = self.session.post(
-                f"{self.base_url}/grm",
-                json=payload,
-                headers=self.headers
-            )
-            resp_str = response.text
-            response.raise_for_status()
-            
-            # Parsowanie odpowiedzi
-            data = response.json()
+            resp_str, data = self._post_grm(payload)
             
             # Przetwarzanie danych GRM
             seat_status = {}
@@ -167,10 +207,7 @@ class BilkomClient:
                 "returnBGMRecordsInfo": False
             }
             req_str = json.dumps(payload, ensure_ascii=False, indent=2)
-            response = self.session.post(f"{self.base_url}/grm", json=payload, headers=self.headers)
-            resp_str = response.text
-            response.raise_for_status()
-            data = response.json()
+            resp_str, data = self._post_grm(payload)
             # Przetwarzanie miejsc
             seat_status = {}
             for carriage in data.get('carriages', []):
@@ -184,31 +221,166 @@ class BilkomClient:
         except Exception as e:
             raise Exception(f"Błąd podczas pobierania miejsc (CARRIAGE) dla odcinka: {str(e)}")
 
+    @staticmethod
+    def parse_travel_plans(schema_data: dict) -> List[Dict]:
+        """Zwraca relacje wagonów (carriages[].travelPlan) z odpowiedzi SCHEMA."""
+        plans = []
+        for carriage in (schema_data or {}).get('carriages', []):
+            travel_plan = carriage.get('travelPlan') or {}
+            from_epa = travel_plan.get('fromStationNumber')
+            to_epa = travel_plan.get('toStationNumber')
+            plans.append({
+                'wagon': str(carriage.get('carriageNumber')),
+                'from_epa': str(from_epa) if from_epa else None,
+                'to_epa': str(to_epa) if to_epa else None
+            })
+        return plans
+
+    @staticmethod
+    def plan_sections(stations: List[str], travel_plans: List[Dict], selected_wagons=None) -> List[Dict]:
+        """Planuje, które odcinki trzeba pobrać i dla których wagonów.
+
+        Zwraca listę odcinków {'from', 'to', 'wagons'}; pusta lista 'wagons'
+        oznacza, że żaden wybrany wagon nie jedzie na tym odcinku i odcinek
+        można pominąć. Bez planów podróży (lub dla wagonu, którego stacji nie
+        ma na trasie) zakładamy, że wagon jedzie całą trasą.
+        """
+        sections_count = max(len(stations) - 1, 0)
+        index = {epa: i for i, epa in enumerate(stations)}
+        wagons_per_section = [set() for _ in range(sections_count)]
+        if not travel_plans:
+            # Brak informacji o składzie - pobieramy wszystkie odcinki
+            return [{'from': stations[i], 'to': stations[i + 1], 'wagons': None} for i in range(sections_count)]
+        for plan in travel_plans:
+            wagon = plan['wagon']
+            if selected_wagons is not None and wagon not in selected_wagons:
+                continue
+            start = index.get(plan.get('from_epa'), 0)
+            end = index.get(plan.get('to_epa'), sections_count)
+            for i in range(start, min(end, sections_count)):
+                wagons_per_section[i].add(wagon)
+        return [
+            {'from': stations[i], 'to': stations[i + 1], 'wagons': sorted(wagons_per_section[i], key=int)}
+            for i in range(sections_count)
+        ]
+
+class GrmResponseCache:
+    """Wspólny (między wątkami) cache odpowiedzi /grm z czasem ważności per wpis.
+
+    Rozmiar ograniczony jest limitem pamięci max_bytes (jak w ResultStore):
+    przy przepełnieniu najpierw usuwane są wpisy przeterminowane, potem
+    najdawniej używane.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_GRM_CACHE_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # klucz zapytania -> (termin ważności, czas zapisu, odpowiedź, rozmiar)
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _drop(self, key: str):
+        self._size -= self._entries.pop(key)[3]
+
+    def get(self, key: str, max_age: float = None):
+        """Zwraca (czas zapisu, odpowiedź) albo None; max_age odrzuca wpisy starsze niż podana liczba sekund."""
+        with self._lock:
+            item = self._entries.get(key)
+            now = time.time()
+            if item is not None and item[0] < now:
+                self._drop(key)
+                item = None
+            if item is None or (max_age is not None and now - item[1] > max_age):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return item[1], item[2]
+
+    def put(self, key: str, value, ttl: float):
+        size = estimate_size(key) + estimate_size(value)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            if size > self.max_bytes:
+                return
+            now = time.time()
+            self._entries[key] = (now + ttl, now, value, size)
+            self._size += size
+            if self._size > self.max_bytes:
+                for expired in [k for k, item in self._entries.items() if item[0] < now]:
+                    self._drop(expired)
+            while self._size > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
 class StationMapper:
     def __init__(self, csv_path="sources/all_stations.csv"):
-        self.epa_to_name = {}
-        self.hafas_to_name = {}
-        self.epa_to_hafas = {}
-        if not os.path.exists(csv_path):
-            csv_path = os.path.join("__pycache__", csv_path)
-        try:
-            with open(csv_path, encoding="windows-1252", errors="replace") as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    name = row["NZ_16_ASCII"].strip()
-                    hafas = row["HAFAS_ID"].strip()
-                    epa = row["EPA_ID"].strip()
-                    # EPA: jeśli krótszy niż 6 znaków, to 5100000+int(epa)
-                    if epa:
-                        if len(epa) < 6:
-                            epa_num = str(5100000 + int(epa))
-                        else:
-                            epa_num = epa
-                        self.epa_to_name[epa_num] = name
+        # Plik CSV wczytujemy dopiero przy pierwszym użyciu mapowania
+        self.csv_path = csv_path
+        self._loaded = False
+        # Mapowanie jest współdzielone między wątkami - wczytuje je tylko jeden z nich
+        self._load_lock = threading.Lock()
+        self._epa_to_name = {}
+        self._hafas_to_name = {}
+        self._epa_to_hafas = {}
+
+    @property
+    def epa_to_name(self) -> Dict[str, str]:
+        self._load()
+        return self._epa_to_name
+
+    @property
+    def hafas_to_name(self) -> Dict[str, str]:
+        self._load()
+        return self._hafas_to_name
+
+    @property
+    def epa_to_hafas(self) -> Dict[str, str]:
+        self._load()
+        return self._epa_to_hafas
+
+    def _load(self):
+        if self._loaded:
+            return
+        with self._load_lock:
+            if self._loaded:
+                return
+            epa_to_name, hafas_to_name, epa_to_hafas = {}, {}, {}
+            csv_path = self.csv_path
+            if not os.path.exists(csv_path):
+                csv_path = os.path.join("__pycache__", csv_path)
+            try:
+                with open(csv_path, encoding="windows-1252", errors="replace") as f:
+                    reader = csv.DictReader(f)
+                    for row in reader:
+                        name = row["NZ_16_ASCII"].strip()
+                        hafas = row["HAFAS_ID"].strip()
+                        epa = row["EPA_ID"].strip()
+                        # EPA: jeśli krótszy niż 6 znaków, to 5100000+int(epa)
+                        if epa:
+                            if len(epa) < 6:
+                                epa_num = str(5100000 + int(epa))
+                            else:
+                                epa_num = epa
+                            epa_to_name[epa_num] = name
+                            if hafas:
+                                epa_to_hafas[epa_num] = hafas
                         if hafas:
-                            self.epa_to_hafas[epa_num] = hafas
-                    if hafas:
-                        self.hafas_to_name[hafas] = name
-            print("Mapowanie EPA na nazwy stacji:", self.epa_to_name)
-        except Exception as e:
-            print(f"Nie udało się wczytać bazy stacji: {e}") 
\ No newline at end of file
+                            hafas_to_name[hafas] = name
+                print("Mapowanie EPA na nazwy stacji:", epa_to_name)
+            except Exception as e:
+                print(f"Nie udało się wczytać bazy stacji: {e}")
+            self._epa_to_name, self._hafas_to_name, self._epa_to_hafas = epa_to_name, hafas_to_name, epa_to_hafas
+            # Flagę ustawiamy dopiero po wypełnieniu słowników
+            self._loaded = True
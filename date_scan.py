@@ -0,0 +1,134 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from bilkom_client import BilkomClient, StationMapper
+from analysis import load_schema
+
+# Format daty w linkach BILKOM: DDMMYYYYHHMM
+BILKOM_DATE_FORMAT = "%d%m%Y%H%M"
+
+# Znaczniki w 'free' zamiast liczby wolnych miejsc
+SCAN_NOT_IN_CONSIST = "N"  # żaden wybrany wagon nie jedzie na odcinku
+SCAN_NO_BUDGET = "budget"  # wyczerpany limit zapytań
+SCAN_ERROR = "error"  # błąd pobierania odcinka
+
+
+class RequestBudget:
+    """Wspólny (między wątkami) limit zapytań do API BILKOM."""
+
+    def __init__(self, max_requests: int):
+        self.max_requests = max_requests
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def take(self) -> bool:
+        with self._lock:
+            if self.used >= self.max_requests:
+                return False
+            self.used += 1
+            return True
+
+
+def date_range(date: str, days: int) -> List[str]:
+    start = datetime.strptime(date, BILKOM_DATE_FORMAT)
+    return [(start + timedelta(days=offset)).strftime(BILKOM_DATE_FORMAT) for offset in range(days)]
+
+
+def scan_dates(params: Dict, days: int = 14, max_requests: int = 400, workers: int = 6,
+               selected_wagons=None, mapper: Optional[StationMapper] = None, timeout: float = 30.0) -> Dict:
+    """Liczba wolnych miejsc na każdym odcinku dla kolejnych dni tego samego pociągu.
+
+    SCHEMA pobierana jest raz dla trasy z dnia bazowego (params['date']) i
+    ponownie tylko dla dni, w których odcinki tej trasy nie dały się pobrać.
+    Zapytania o odcinki dla wszystkich dni idą równolegle w ramach max_requests.
+    Odcinki bez liczby wolnych miejsc oznaczane są SCAN_NOT_IN_CONSIST,
+    SCAN_NO_BUDGET albo SCAN_ERROR.
+    """
+    mapper = mapper or StationMapper()
+    budget = RequestBudget(max_requests)
+    local = threading.local()
+
+    def client() -> BilkomClient:
+        # Osobna sesja HTTP dla każdego wątku
+        if not hasattr(local, 'client'):
+            local.client = BilkomClient(timeout=timeout)
+        return local.client
+
+    def fetch_free(schema, section, date):
+        if section['wagons'] == []:
+            return SCAN_NOT_IN_CONSIST
+        if not budget.take():
+            return SCAN_NO_BUDGET
+        seat_status, _, _ = client().get_carriages_for_section(
+            section['from'], section['to'], params['train_number'], date
+        )
+        running = set(section['wagons']) if section['wagons'] is not None else None
+        return sum(
+            1 for seat, status in seat_status.items()
+            if str(status).upper() == "AVAILABLE" and (running is None or seat.split('-')[0] in running)
+        )
+
+    def scan_route(pool, schema, dates) -> Dict[str, list]:
+        plan = BilkomClient.plan_sections(schema['stations'], schema['travel_plans'], selected_wagons)
+        futures = {date: [pool.submit(fetch_free, schema, section, date) for section in plan] for date in dates}
+        free = {}
+        for date, date_futures in futures.items():
+            free[date] = []
+            for future in date_futures:
+                try:
+                    free[date].append(future.result())
+                except Exception as e:
+                    logging.error(f"Skan dat: błąd pobierania odcinka ({date}): {e}")
+                    free[date].append(SCAN_ERROR)
+        return free
+
+    if not budget.take():
+        raise ValueError("Limit zapytań nie wystarcza nawet na pobranie trasy")
+    base_schema, _, _ = load_schema(client(), mapper, params)
+    base_route = tuple(base_schema['stations'])
+    routes = {base_route: base_schema}
+    day_routes = {}  # data -> trasa, jeśli inna niż w dniu bazowym
+    dates = date_range(params['date'], days)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="date-scan") as pool:
+        free = scan_route(pool, base_schema, dates)
+        # Dni z błędami - sprawdzamy, czy pociąg nie jedzie wtedy inną trasą
+        for date in [d for d in dates if SCAN_ERROR in free[d]]:
+            if not budget.take():
+                break
+            try:
+                schema, _, _ = load_schema(client(), mapper, dict(params, date=date))
+            except Exception as e:
+                logging.error(f"Skan dat: brak trasy pociągu {params['train_number']} ({date}): {e}")
+                continue
+            route = tuple(schema['stations'])
+            if route == base_route:
+                continue
+            routes.setdefault(route, schema)
+            day_routes[date] = route
+            free.update(scan_route(pool, routes[route], [date]))
+
+    report = []
+    for date in dates:
+        stations = day_routes.get(date, base_route)
+        # Odcinki poza składem wybranych wagonów nie wpływają na kompletność ani minimum
+        counts = [count for count in free[date] if count != SCAN_NOT_IN_CONSIST]
+        known = [count for count in counts if isinstance(count, int)]
+        complete = len(known) == len(counts)
+        report.append({
+            'date': date,
+            'sections': [f"{a}-{b}" for a, b in zip(stations, stations[1:])],
+            'free': free[date],
+            'min_free': min(known) if known and complete else None,
+            'complete': complete
+        })
+    return {
+        'summary': base_schema['summary'],
+        'station_info': {epa: info for schema in routes.values() for epa, info in schema['station_info'].items()},
+        'routes': len(routes),
+        'dates': report,
+        'requests': budget.used,
+        'max_requests': max_requests
+    }
@@ -0,0 +1,103 @@
+import base64
+import hashlib
+import json
+import os
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+
+from analysis import status_matrix, STATUS_ORDER
+from bilkom_client import NOT_IN_CONSIST
+
+if TYPE_CHECKING:
+    import numpy
+
+# 2-bitowe kody komórek: 0 wolne, 1 zarezerwowane, 2 zablokowane, 3 brak danych.
+# "Poza składem" nie ma własnego kodu - przeglądarka odtwarza go z maski 'absent' wagonu.
+CODE_UNKNOWN = 3
+_NOT_IN_CONSIST_CODE = STATUS_ORDER.index(NOT_IN_CONSIST)
+
+_FRONTEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "grid_frontend")
+_component = None
+
+
+def pack_codes(codes: "numpy.ndarray") -> str:
+    """Pakuje kody 0-3 po cztery w bajcie (najmłodsze bity = pierwsza komórka) i koduje base64."""
+    # numpy importowany dopiero przy pierwszej tabeli - nie spowalnia startu aplikacji
+    import numpy as np
+    flat = np.asarray(codes, dtype=np.uint8).ravel()
+    pad = (-len(flat)) % 4
+    if pad:
+        flat = np.concatenate([flat, np.zeros(pad, dtype=np.uint8)])
+    quads = flat.reshape(-1, 4)
+    packed = quads[:, 0] | (quads[:, 1] << 2) | (quads[:, 2] << 4) | (quads[:, 3] << 6)
+    return base64.b64encode(packed.astype(np.uint8).tobytes()).decode('ascii')
+
+
+def unpack_codes(packed: str, count: int) -> "numpy.ndarray":
+    import numpy as np
+    data = np.frombuffer(base64.b64decode(packed), dtype=np.uint8)
+    codes = np.stack([(data >> shift) & 3 for shift in (0, 2, 4, 6)], axis=1).ravel()
+    return codes[:count]
+
+
+def encode_grid(analysis: Dict) -> Tuple[Dict, "numpy.ndarray"]:
+    """Zwraca indeks tabeli (odcinki, wagony, miejsca) i płaską tablicę 2-bitowych kodów (miejsca x odcinki)."""
+    import numpy as np
+    matrix = status_matrix(analysis)
+    codes = np.minimum(matrix, CODE_UNKNOWN).astype(np.uint8)
+    absent = matrix == _NOT_IN_CONSIST_CODE
+    seat_properties = analysis['seat_properties']
+    wagons = []
+    class1 = []
+    for row, seat in enumerate(analysis['seats_sorted']):
+        wagon, number = seat.split('-')
+        if not wagons or wagons[-1]['wagon'] != wagon:
+            wagons.append({'wagon': wagon, 'offset': row, 'seats': []})
+        wagons[-1]['seats'].append(number)
+        if "CLASS_1" in seat_properties.get(seat, []):
+            class1.append(row)
+    for wagon in wagons:
+        rows = slice(wagon['offset'], wagon['offset'] + len(wagon['seats']))
+        wagon['absent'] = "".join("1" if column.all() else "0" for column in absent[rows].T)
+    stations = []
+    for info in analysis['columns']:
+        arrival = info['arrival'][11:16] if info['arrival'] else ""
+        departure = info['departure'][11:16] if info['departure'] else ""
+        stations.append({'name': info['name'], 'time': f"{arrival} / {departure}" if arrival or departure else ""})
+    index = {'stations': stations, 'wagons': wagons, 'class1': class1}
+    return index, codes.ravel()
+
+
+def build_grid_args(previous: Optional[Dict], analysis_id: str, analysis: Dict, ack) -> Tuple[Dict, Dict]:
+    """Przygotowuje dane dla przeglądarki: pełną tabelę albo tylko zmienione komórki.
+
+    previous to stan z poprzedniego przebiegu (trzymany w sesji), ack - wersja
+    potwierdzona przez przeglądarkę. Zwraca (argumenty komponentu, nowy stan).
+    """
+    import numpy as np
+    index, codes = encode_grid(analysis)
+    signature = hashlib.sha1(json.dumps(index, sort_keys=True).encode('utf-8')).hexdigest()
+    packed = pack_codes(codes)
+    same_grid = previous is not None and previous['analysis_id'] == analysis_id and previous['signature'] == signature
+    if same_grid and previous['packed'] == packed:
+        version = previous['version']
+        changed = np.zeros(0, dtype=np.int64)
+    else:
+        version = (previous['version'] + 1) if previous else 1
+        changed = np.nonzero(unpack_codes(previous['packed'], codes.size) != codes)[0] if same_grid else None
+    state = {'analysis_id': analysis_id, 'signature': signature, 'version': version, 'packed': packed}
+    if same_grid and ack == previous['version']:
+        # Przeglądarka ma poprzednią wersję - wysyłamy tylko różnice
+        args = {'version': version, 'base': previous['version'],
+                'delta': {'cells': changed.tolist(), 'codes': pack_codes(codes[changed])}}
+    else:
+        args = {'version': version, 'full': {'index': index, 'codes': packed, 'count': int(codes.size)}}
+    return args, state
+
+
+def grm_grid(args: Dict, visible_wagons, key: str = "grm_grid"):
+    """Rysuje tabelę miejsc w przeglądarce; zwraca {'ack': wersja, 'seat': kliknięte miejsce}."""
+    global _component
+    if _component is None:
+        import streamlit.components.v1 as components
+        _component = components.declare_component("grm_grid", path=_FRONTEND_DIR)
+    return _component(payload=args, visible=list(visible_wagons), key=key, default=None)
@@ -1,17 +1,55 @@
+import os
+import sys
+import time
+
+# Tryb profilowania startu: python main.py --profile-startup (lub BILKOM_PROFILE_STARTUP=1)
+PROFILE_STARTUP = "--profile-startup" in sys.argv or bool(os.environ.get("BILKOM_PROFILE_STARTUP"))
+_startup_t0 = time.perf_counter()
+_startup_phases = []  # (nazwa fazy, czas fazy [s], pamięć [B])
+if PROFILE_STARTUP:
+    import tracemalloc
+    tracemalloc.start()
+
+def mark_startup_phase(name):
+    """Zapisuje czas fazy startu liczony od poprzedniej fazy (tylko w trybie profilowania)."""
+    global _startup_t0
+    if not PROFILE_STARTUP:
+        return
+    now = time.perf_counter()
+    _startup_phases.append((name, now - _startup_t0, tracemalloc.get_traced_memory()[0]))
+    _startup_t0 = now
+
+def report_startup_profile():
+    if not PROFILE_STARTUP:
+        return
+    total = sum(duration for _, duration, _ in _startup_phases)
+    lines = ["Profil startu aplikacji:"]
+    for name, duration, memory in _startup_phases:
+        lines.append(f"  {name:<28} {duration * 1000:8.1f} ms  {memory / 1024 / 1024:7.1f} MB")
+    lines.append(f"  {'RAZEM (do interakcji)':<28} {total * 1000:8.1f} ms  szczyt {tracemalloc.get_traced_memory()[1] / 1024 / 1024:.1f} MB")
+    report = "\n".join(lines)
+    print(report)
+    logging.info(report)
+
 import customtkinter as ctk
 import tkinter as tk
 from tkinter import messagebox
+mark_startup_phase("import customtkinter")
 from bilkom_client import BilkomClient, StationMapper
+from analysis import load_schema, run_analysis
 from results_viewer import ResultsViewer
+mark_startup_phase("import bilkom_client/viewer")
 import traceback
 import logging
-import json
-import subprocess
-import webbrowser
+import socket
 
 # Konfiguracja logowania do pliku
 logging.basicConfig(filename='app.log', level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
 
+STREAMLIT_PORT = 8501
+# Maksymalny czas oczekiwania na start serwera Streamlit (s)
+STREAMLIT_START_TIMEOUT = 30
+
 class BilkomAnalyzer(ctk.CTk):
     def __init__(self):
         super().__init__()
@@ -24,9 +62,11 @@ class BilkomAnalyzer(ctk.CTk):
         ctk.set_appearance_mode("dark")
         ctk.set_default_color_theme("blue")
 
-        # Inicjalizacja klienta BILKOM
-        self.bilkom_client = BilkomClient()
-        self.station_mapper = StationMapper()
+        # Klient BILKOM i mapowanie stacji tworzone przy pierwszym użyciu
+        self._bilkom_client = None
+        self._station_mapper = None
+        self._streamlit_process = None
+        mark_startup_phase("okno główne")
 
         # Tworzenie głównego kontenera
         self.main_frame = ctk.CTkFrame(self)
@@ -78,6 +118,19 @@ class BilkomAnalyzer(ctk.CTk):
         self.api_log_text = ctk.CTkTextbox(self.main_frame, width=1100, height=200, font=("Roboto", 10))
         self.api_log_text.pack(pady=(0, 10))
         self.api_log_text.configure(state="disabled")
+        mark_startup_phase("budowa widżetów")
+
+    @property
+    def bilkom_client(self) -> BilkomClient:
+        if self._bilkom_client is None:
+            self._bilkom_client = BilkomClient()
+        return self._bilkom_client
+
+    @property
+    def station_mapper(self) -> StationMapper:
+        if self._station_mapper is None:
+            self._station_mapper = StationMapper()
+        return self._station_mapper
 
     def log_api(self, title, request_data, response_data=None):
         self.api_log_text.configure(state="normal")
@@ -100,58 +153,21 @@ class BilkomAnalyzer(ctk.CTk):
 
         try:
             params = self.bilkom_client.parse_url(url)
-            if not all([params['from_station'], params['to_station'], params['date'], params['train_number']]):
-                raise ValueError(f"Brak wymaganych parametrów w linku: {params}")
-
-            # Pobierz listę stacji (epaNumber)
-            stations, req1, resp1 = self.bilkom_client.get_train_stations(
-                params['from_station'],
-                params['to_station'],
-                params['train_number'],
-                params['date']
-            )
+
+            # Pobierz listę stacji (epaNumber) i plany podróży wagonów
+            schema, req1, resp1 = load_schema(self.bilkom_client, self.station_mapper, params)
             self.log_api("SCHEMA (stacje)", req1, resp1)
 
-            if len(stations) < 2:
-                raise ValueError("Za mało stacji na trasie!")
-
-            # Dla każdej pary kolejnych stacji pobierz status miejsc
-            results = {}  # {kolumna: {wagon-miejsce: status}}
-            all_seats = set()
-            seat_properties = {}  # seat_key -> properties
-            for i in range(len(stations) - 1):
-                from_epa = stations[i]
-                to_epa = stations[i + 1]
-                seat_status, req2, resp2 = self.bilkom_client.get_carriages_for_section(
-                    from_epa,
-                    to_epa,
-                    params['train_number'],
-                    params['date']
-                )
-                col_name = f"{from_epa}-{to_epa}"
-                results[col_name] = seat_status
-                all_seats.update(seat_status.keys())
-                # Zbieraj properties dla miejsc
-                try:
-                    carriages_json = json.loads(resp2)
-                    for carriage in carriages_json.get('carriages', []):
-                        wagon = carriage.get('carriageNumber')
-                        for spot in carriage.get('spots', []):
-                            seat_key = f"{wagon}-{spot.get('number')}"
-                            seat_properties[seat_key] = spot.get('properties', [])
-                except Exception as e:
-                    logging.error(f"Błąd dekodowania JSON z odpowiedzi CARRIAGE: {e}")
-                self.log_api(f"CARRIAGE {col_name}", req2)
-
-            # Budujemy tabelę: wiersze = wagon-miejsce, kolumny = kolejne odcinki
-            def seat_sort_key(seat):
-                wagon, number = seat.split('-')
-                return (int(wagon), int(number))
-            seats_sorted = sorted(all_seats, key=seat_sort_key)
-            table = {seat: {} for seat in seats_sorted}
-            for col in results:
-                for seat in seats_sorted:
-                    table[seat][col] = results[col].get(seat, "unknown")
+            # Dla każdej pary kolejnych stacji pobierz status miejsc (odcinki poza składem są pomijane)
+            def log_section(done, total, col_name, request):
+                if request is None:
+                    self.log_api(f"POMINIĘTO {col_name} (brak wagonów w składzie)", "")
+                else:
+                    self.log_api(f"CARRIAGE {col_name}", request)
+            analysis = run_analysis(self.bilkom_client, schema, on_section=log_section)
+            results = analysis['results']  # {kolumna: {wagon-miejsce: status}}
+            seats_sorted = analysis['seats_sorted']
+            seat_properties = analysis['seat_properties']  # seat_key -> properties
 
             # Log do pliku
             logging.info(f"Tabela: miejsc={len(seats_sorted)}, kolumn={len(results)}")
@@ -159,9 +175,16 @@ class BilkomAnalyzer(ctk.CTk):
             def get_station_name(epa_num):
                 return self.station_mapper.epa_to_name.get(epa_num, epa_num)
             pretty_columns = [f"{get_station_name(col.split('-')[0])} ({col.split('-')[0]})" for col in results.keys()]
-            self.results_viewer.display_results(table, pretty_columns, seat_properties)
+            # Budujemy tabelę: wiersze = wagon-miejsce, kolumny = kolejne odcinki (klucze jak nagłówki)
+            table = {seat: {} for seat in seats_sorted}
+            for col, pretty in zip(results, pretty_columns):
+                for seat in seats_sorted:
+                    table[seat][pretty] = results[col].get(seat, "unknown")
+            summary = analysis['wagon_summary']
+            # Najpierw podsumowanie wagonów; miejsca po rozwinięciu wagonu
+            self.results_viewer.display_results(table, pretty_columns, seat_properties, summary)
             # Obsługa chipsów (odświeżanie po kliknięciu)
-            self.results_viewer.bind("<<RefreshResults>>", lambda e: self.results_viewer.display_results(table, pretty_columns, seat_properties))
+            self.results_viewer.bind("<<RefreshResults>>", lambda e: self.results_viewer.display_results(table, pretty_columns, seat_properties, summary))
         except Exception as e:
             error_msg = f"Wystąpił błąd: {str(e)}\n{traceback.format_exc()}"
             logging.error(error_msg)
@@ -172,11 +195,51 @@ class BilkomAnalyzer(ctk.CTk):
         # Zapisz link do pliku tymczasowego
         with open("web_link.txt", "w", encoding="utf-8") as f:
             f.write(url)
-        # Uruchom streamlit w tle
-        subprocess.Popen(["streamlit", "run", "web_app.py"])
-        # Otwórz przeglądarkę
-        webbrowser.open_new_tab("http://localhost:8501")
+        # Uruchom streamlit w tle tylko, jeśli serwer jeszcze nie działa
+        if not self._streamlit_running():
+            import subprocess
+            self._streamlit_process = subprocess.Popen([
+                "streamlit", "run", "web_app.py",
+                "--server.port", str(STREAMLIT_PORT),
+                "--server.headless", "true"
+            ])
+        # Otwórz przeglądarkę dopiero, gdy serwer przyjmuje połączenia (zimny start trwa kilka sekund)
+        self._open_browser_when_ready(time.time() + STREAMLIT_START_TIMEOUT)
+
+    def _open_browser_when_ready(self, deadline: float):
+        if not self._streamlit_listening():
+            process_alive = self._streamlit_process is not None and self._streamlit_process.poll() is None
+            if not process_alive:
+                messagebox.showerror("Błąd", "Nie udało się uruchomić serwera Streamlit")
+                return
+            if time.time() < deadline:
+                # Sprawdzamy ponownie bez blokowania okna
+                self.after(250, self._open_browser_when_ready, deadline)
+                return
+            logging.warning(f"Serwer Streamlit nie odpowiada po {STREAMLIT_START_TIMEOUT} s - otwieram przeglądarkę")
+        import webbrowser
+        webbrowser.open_new_tab(f"http://localhost:{STREAMLIT_PORT}")
+
+    def _streamlit_running(self) -> bool:
+        if self._streamlit_process is not None and self._streamlit_process.poll() is None:
+            return True
+        # Serwer mógł zostać uruchomiony wcześniej (np. przez inną instancję aplikacji)
+        return self._streamlit_listening()
+
+    @staticmethod
+    def _streamlit_listening() -> bool:
+        try:
+            with socket.create_connection(("localhost", STREAMLIT_PORT), timeout=0.3):
+                return True
+        except OSError:
+            return False
 
 if __name__ == "__main__":
     app = BilkomAnalyzer()
-    app.mainloop() 
\ No newline at end of file
+    if PROFILE_STARTUP:
+        def on_first_paint():
+            mark_startup_phase("pierwsze rysowanie")
+            report_startup_profile()
+        app.after_idle(on_first_paint)
+    app.mainloop()
+ 
\ No newline at end of file
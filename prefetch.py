@@ -0,0 +1,226 @@
+import logging
+import math
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from bilkom_client import BilkomClient, GrmResponseCache, StationMapper, DEFAULT_GRM_CACHE_MB
+from analysis import load_schema
+from date_scan import BILKOM_DATE_FORMAT
+
+# (sekundy do odjazdu, odstęp odświeżania [s]) - im bliżej odjazdu, tym częściej
+REFRESH_INTERVALS = (
+    (3600, 120),
+    (6 * 3600, 300),
+    (24 * 3600, 900),
+    (math.inf, 1800)
+)
+
+
+def refresh_interval(seconds_to_departure: float) -> float:
+    for limit, interval in REFRESH_INTERVALS:
+        if seconds_to_departure <= limit:
+            return interval
+    return REFRESH_INTERVALS[-1][1]
+
+
+class PrefetchScheduler:
+    """Rozgrzewa cache odpowiedzi /grm (SCHEMA + CARRIAGE) dla najpopularniejszych pociągów.
+
+    Popularność (train, date) liczona jest z wygasaniem wykładniczym na podstawie
+    rzeczywistych analiz (BilkomClient.usage_listener). Liczba zapytań do BILKOM
+    ograniczona jest budżetem max_requests_per_hour (token bucket).
+    """
+
+    def __init__(self, cache: Optional[GrmResponseCache] = None, max_requests_per_hour: int = 600,
+                 top_n: int = 30, tick: float = 30.0, half_life: float = 3600.0, timeout: float = 30.0,
+                 min_score: float = 1.5, interactive_max_age: float = 120.0):
+        self.cache = cache or GrmResponseCache()
+        self.max_requests_per_hour = max_requests_per_hour
+        self.top_n = top_n
+        self.tick = tick
+        self.half_life = half_life
+        self.timeout = timeout
+        # Pociągi pytane tylko raz nie są rozgrzewane
+        self.min_score = min_score
+        # Zapytania interaktywne nie używają odpowiedzi starszych niż interactive_max_age (s),
+        # nawet jeśli wpis rozgrzany dla odległego pociągu jest jeszcze ważny
+        self.interactive_max_age = interactive_max_age
+        self.station_mapper = StationMapper()
+        self._trains = {}  # (train_number, date) -> {'params', 'score', 'seen', 'next_refresh', 'sections'}
+        self._lock = threading.Lock()
+        self._tokens = float(max_requests_per_hour)
+        self._tokens_at = time.time()
+        self._stop = threading.Event()
+        self._thread = None
+        self.prefetched = 0
+        self.requests = 0
+
+    def make_client(self, timeout: float = None, force_refresh: bool = False) -> BilkomClient:
+        """Klient do zapytań interaktywnych: czyta z rozgrzanego cache i zgłasza użycie.
+
+        force_refresh - zawsze pyta BILKOM (np. ponowne pobranie na żądanie), zapisując wynik do cache.
+        """
+        client = BilkomClient(timeout=timeout, cache=self.cache, usage_listener=self.record)
+        client.cache_max_age = self.interactive_max_age
+        client.cache_reads = not force_refresh
+        return client
+
+    def record(self, params: Dict):
+        """Zapisuje użycie pociągu (wywoływane przy pobraniu SCHEMA)."""
+        if not all([params.get('from_station'), params.get('to_station'), params.get('date'), params.get('train_number')]):
+            return
+        key = (str(params['train_number']), str(params['date']))
+        now = time.time()
+        with self._lock:
+            entry = self._trains.get(key)
+            if entry is None:
+                entry = self._trains[key] = {'params': dict(params), 'score': 0.0, 'seen': now,
+                                             'next_refresh': 0.0, 'sections': 1}
+            entry['score'] = self._decayed(entry, now) + 1.0
+            entry['seen'] = now
+            entry['params'] = dict(params)
+
+    def _decayed(self, entry: Dict, now: float) -> float:
+        return entry['score'] * 0.5 ** ((now - entry['seen']) / self.half_life)
+
+    def _departure(self, date: str) -> Optional[float]:
+        try:
+            return datetime.strptime(date, BILKOM_DATE_FORMAT).timestamp()
+        except ValueError:
+            return None
+
+    def _refresh_interval(self, seconds_to_departure: float) -> float:
+        """Odstęp odświeżania wg REFRESH_INTERVALS, skrócony tak, by rozgrzane dane były zawsze
+        młodsze niż interactive_max_age (planista budzi się co tick) - inaczej budżet szedłby na dane,
+        których zapytania interaktywne i tak nie użyją."""
+        return min(refresh_interval(seconds_to_departure), max(self.interactive_max_age - self.tick, 1.0))
+
+    def _take_tokens(self, count: int) -> bool:
+        with self._lock:
+            now = time.time()
+            self._tokens = min(
+                float(self.max_requests_per_hour),
+                self._tokens + (now - self._tokens_at) * self.max_requests_per_hour / 3600.0
+            )
+            self._tokens_at = now
+            if self._tokens < count:
+                return False
+            self._tokens -= count
+            return True
+
+    def due_trains(self) -> List[Dict]:
+        """Najpopularniejsze pociągi, dla których minął czas odświeżenia (od najgorętszych)."""
+        now = time.time()
+        with self._lock:
+            for key, entry in list(self._trains.items()):
+                departure = self._departure(key[1])
+                # Pociągi po odjeździe i zapomniane (wynik bliski zera) usuwamy
+                if departure is None or departure < now or self._decayed(entry, now) < 0.05:
+                    del self._trains[key]
+            ranked = sorted(self._trains.items(), key=lambda item: self._decayed(item[1], now), reverse=True)
+            return [
+                dict(entry, key=key) for key, entry in ranked[:self.top_n]
+                if entry['next_refresh'] <= now and self._decayed(entry, now) >= self.min_score
+            ]
+
+    def prefetch(self, entry: Dict) -> bool:
+        """Pobiera SCHEMA i wszystkie odcinki CARRIAGE pociągu do cache. False - brak budżetu."""
+        params = entry['params']
+        seconds_to_departure = self._departure(params['date']) - time.time()
+        interval = self._refresh_interval(seconds_to_departure)
+        # Koszt: SCHEMA + odcinki (liczba odcinków z poprzedniego pobrania)
+        if not self._take_tokens(1 + entry['sections']):
+            return False
+        client = BilkomClient(timeout=self.timeout, cache=self.cache)
+        client.cache_reads = False
+        # Dane ważne do następnego odświeżenia (z zapasem na jeden cykl planisty)
+        client.cache_ttl = interval + self.tick
+        schema, _, _ = load_schema(client, self.station_mapper, params)
+        plan = BilkomClient.plan_sections(schema['stations'], schema['travel_plans'])
+        sections = [section for section in plan if section['wagons'] != []]
+        section_count = max(len(sections), 1)
+        # Dobieramy brakujące tokeny, jeśli trasa okazała się dłuższa niż zakładano
+        extra = len(sections) - entry['sections']
+        if extra > 0 and not self._take_tokens(extra):
+            sections = sections[:entry['sections']]
+        for section in sections:
+            client.get_carriages_for_section(section['from'], section['to'], params['train_number'], params['date'])
+        with self._lock:
+            stored = self._trains.get(entry['key'])
+            if stored is not None:
+                stored['next_refresh'] = time.time() + interval
+                stored['sections'] = section_count
+            self.prefetched += 1
+            self.requests += 1 + len(sections)
+        return True
+
+    def run_once(self):
+        for entry in self.due_trains():
+            if self._stop.is_set():
+                return
+            try:
+                if not self.prefetch(entry):
+                    # Budżet wyczerpany - reszta poczeka na kolejny cykl
+                    return
+            except Exception as e:
+                logging.error(f"Prefetch: błąd dla pociągu {entry['key']}: {e}")
+                with self._lock:
+                    stored = self._trains.get(entry['key'])
+                    if stored is not None:
+                        stored['next_refresh'] = time.time() + REFRESH_INTERVALS[0][1]
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.run_once()
+            self._stop.wait(self.tick)
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="grm-prefetch", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self) -> Dict:
+        now = time.time()
+        with self._lock:
+            hottest = sorted(self._trains.items(), key=lambda item: self._decayed(item[1], now), reverse=True)
+            return {
+                'tracked': len(self._trains),
+                'hottest': [
+                    {'train': key[0], 'date': key[1], 'score': round(self._decayed(entry, now), 2)}
+                    for key, entry in hottest[:5]
+                ],
+                'prefetched': self.prefetched,
+                'requests': self.requests,
+                'budget_per_hour': self.max_requests_per_hour,
+                'tokens': round(self._tokens, 1),
+                'cache': self.cache.stats()
+            }
+
+
+_default_scheduler = None
+_default_scheduler_lock = threading.Lock()
+
+
+def get_prefetch_scheduler() -> PrefetchScheduler:
+    """Wspólny dla procesu planista; budżet z BILKOM_PREFETCH_BUDGET (zapytań/h, 0 - bez rozgrzewania),
+    maksymalny wiek danych dla zapytań interaktywnych z BILKOM_CACHE_MAX_AGE (s),
+    limit pamięci cache /grm z BILKOM_GRM_CACHE_MB."""
+    global _default_scheduler
+    with _default_scheduler_lock:
+        if _default_scheduler is None:
+            budget = int(os.environ.get("BILKOM_PREFETCH_BUDGET", 600))
+            max_age = float(os.environ.get("BILKOM_CACHE_MAX_AGE", 120))
+            cache_mb = float(os.environ.get("BILKOM_GRM_CACHE_MB", DEFAULT_GRM_CACHE_MB))
+            _default_scheduler = PrefetchScheduler(GrmResponseCache(int(cache_mb * 1024 * 1024)),
+                                                   max_requests_per_hour=budget, interactive_max_age=max_age)
+            if budget > 0:
+                _default_scheduler.start()
+        return _default_scheduler
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+import sys
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+# Limit pamięci wspólnego magazynu wyników (MB), np. BILKOM_RESULT_STORE_MB=512
+DEFAULT_MAX_MB = 256
+
+
+def make_analysis_id(params: Dict, wagons=None, kind: str = "analysis", **extra) -> str:
+    """Buduje identyfikator analizy z parametrów linku, wybranych wagonów i dodatkowych opcji."""
+    key = json.dumps({
+        **extra,
+        'kind': kind,
+        'train_number': params.get('train_number'),
+        'date': params.get('date'),
+        'from_station': params.get('from_station'),
+        'to_station': params.get('to_station'),
+        'wagons': sorted(wagons, key=int) if wagons is not None else None
+    }, sort_keys=True)
+    return f"{kind}-{hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]}"
+
+
+def estimate_size(obj, _seen=None) -> int:
+    """Szacuje rozmiar obiektu w pamięci (B), łącznie z zawartością kontenerów."""
+    if _seen is None:
+        _seen = set()
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(getattr(obj, 'nbytes', None), int):
+        # Widok tablicy numpy (np. po reshape): getsizeof liczy tylko nagłówek, bez danych
+        if getattr(obj, 'base', None) is not None:
+            size += obj.nbytes
+    elif isinstance(obj, dict):
+        for key, value in obj.items():
+            size += estimate_size(key, _seen) + estimate_size(value, _seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for item in obj:
+            size += estimate_size(item, _seen)
+    return size
+
+
+class ResultStore:
+    """Wspólny dla procesu magazyn wyników analiz z limitem pamięci i usuwaniem LRU.
+
+    Sesje przechowują tylko identyfikator analizy; wpisy są współdzielone
+    i nie powinny być modyfikowane po zapisaniu.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # analysis_id -> (wpis, rozmiar)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def put(self, analysis_id: str, entry: Dict) -> str:
+        size = estimate_size(entry)
+        with self._lock:
+            if analysis_id in self._entries:
+                self._bytes -= self._entries.pop(analysis_id)[1]
+            self._entries[analysis_id] = (entry, size)
+            self._bytes += size
+            # Usuwamy najdawniej używane wpisy; najnowszy zostaje nawet ponad limitem
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self._evictions += 1
+        return analysis_id
+
+    def get(self, analysis_id: Optional[str]) -> Optional[Dict]:
+        if not analysis_id:
+            # Brak identyfikatora (np. sesja bez analizy) nie jest chybieniem
+            return None
+        with self._lock:
+            item = self._entries.get(analysis_id)
+            if item is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(analysis_id)
+            self._hits += 1
+            return item[0]
+
+    def discard(self, analysis_id: str):
+        with self._lock:
+            item = self._entries.pop(analysis_id, None)
+            if item is not None:
+                self._bytes -= item[1]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'usage': self._bytes / self.max_bytes if self.max_bytes else 0.0,
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions
+            }
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_result_store() -> ResultStore:
+    """Zwraca wspólną dla procesu instancję magazynu (limit z BILKOM_RESULT_STORE_MB)."""
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            max_mb = float(os.environ.get("BILKOM_RESULT_STORE_MB", DEFAULT_MAX_MB))
+            _default_store = ResultStore(int(max_mb * 1024 * 1024))
+        return _default_store
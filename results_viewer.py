@@ -10,7 +10,11 @@ class ResultsViewer(ctk.CTkFrame):
         self.seat_properties = {}  # seat_key -> properties
         self._last_table = None
         self._last_columns = None
-        self._last_seat_properties = None
+        self._last_summary = None
+        self._row_cache = {}  # wagon -> widżety zbudowanych wierszy miejsc (ukrywane przez grid_remove)
+        self._seat_rows = {}  # wagon -> (pierwszy wiersz siatki, miejsca wagonu)
+        self._chips = {}  # wagon -> przycisk filtra
+        self._wagon_labels = {}  # wagon -> etykieta wagonu w podsumowaniu
         # Konfiguracja siatki
         self.grid_columnconfigure(0, weight=1)
         self.grid_rowconfigure(0, weight=1)
@@ -30,33 +34,41 @@ class ResultsViewer(ctk.CTkFrame):
         self.canvas.grid(row=1, column=0, sticky="nsew")
         self.scrollbar.grid(row=1, column=1, sticky="ns")
 
-    def display_results(self, table: dict, columns: list, seat_properties: dict = None):
+    def display_results(self, table: dict, columns: list, seat_properties: dict = None, summary: dict = None):
+        if table is self._last_table and columns is self._last_columns and summary is self._last_summary:
+            # Te same wyniki - tylko synchronizujemy widoczność wagonów
+            self._sync_wagons()
+            return
+        # Nowe wyniki - budujemy nagłówki i podsumowanie, wiersze miejsc przy pierwszym rozwinięciu
         self._last_table = table
         self._last_columns = columns
-        self._last_seat_properties = seat_properties
+        self._last_summary = summary
         self.seat_properties = seat_properties or {}
+        self._row_cache = {}
+        self._seat_rows = {}
+        self._wagon_labels = {}
         # Zbierz wszystkie wagony
         self.all_wagons = set()
         for seat in table.keys():
             wagon, _ = seat.split('-')
             self.all_wagons.add(wagon)
-        if not self.selected_wagons:
-            self.selected_wagons = set(self.all_wagons)
-        # Chipsy
+        # Bez podsumowania pokazujemy od razu wszystkie miejsca
+        self.selected_wagons = set() if summary is not None else set(self.all_wagons)
+        # Chipsy (rozwijanie wagonów do poziomu miejsc)
         for widget in self.chips_frame.winfo_children():
             widget.destroy()
+        self._chips = {}
         for wagon in sorted(self.all_wagons, key=int):
             chip = ctk.CTkButton(
                 self.chips_frame,
                 text=f"Wagon {wagon}",
-                fg_color="#1976D2" if wagon in self.selected_wagons else "#B0BEC5",
-                text_color="#fff" if wagon in self.selected_wagons else "#263238",
                 command=lambda w=wagon: self.toggle_wagon_and_refresh(w),
                 width=80,
                 height=28,
                 corner_radius=12
             )
             chip.pack(side=tk.LEFT, padx=4, pady=2)
+            self._chips[wagon] = chip
         # Czyszczenie poprzednich wyników
         for widget in self.scrollable_frame.winfo_children():
             widget.destroy()
@@ -71,15 +83,65 @@ class ResultsViewer(ctk.CTkFrame):
                 font=("Arial", 12, "bold")
             )
             label.grid(row=0, column=i+1, padx=5, pady=5)
-        # Wiersze: sortuj po wagonie i miejscu (oba int)
+        row_idx = 1
+        # Podsumowanie: wolne miejsca na wagon x odcinek (kliknięcie rozwija wagon)
+        if summary is not None:
+            for wagon, wagon_counts in zip(summary['wagons'], summary['counts']):
+                wagon_label = ctk.CTkLabel(
+                    self.scrollable_frame,
+                    font=("Arial", 12, "bold"),
+                    cursor="hand2"
+                )
+                wagon_label.grid(row=row_idx, column=0, padx=5, pady=2, sticky="w")
+                wagon_label.bind("<Button-1>", lambda e, w=wagon: self.toggle_wagon_and_refresh(w))
+                self._wagon_labels[wagon] = wagon_label
+                for col_idx, (free, reserved, blocked, not_in_consist, unknown) in enumerate(wagon_counts):
+                    in_consist = free + reserved + blocked + unknown
+                    count_label = ctk.CTkLabel(
+                        self.scrollable_frame,
+                        text=str(free) if in_consist else "–",
+                        fg_color=self._get_summary_color(free, in_consist),
+                        text_color="#000",
+                        corner_radius=5,
+                        width=40,
+                        height=25
+                    )
+                    count_label.grid(row=row_idx, column=col_idx+1, padx=2, pady=2)
+                row_idx += 1
+        # Każdy wagon ma stały zakres wierszy siatki - puste wiersze zwiniętych wagonów nie zajmują miejsca,
+        # a kolumny pozostają wyrównane z nagłówkami i podsumowaniem
         def seat_sort_key(seat):
             wagon, number = seat.split('-')
             return (int(wagon), int(number))
-        sorted_seats = [seat for seat in sorted(table.keys(), key=seat_sort_key) if seat.split('-')[0] in self.selected_wagons]
-        for row_idx, seat in enumerate(sorted_seats, 1):
-            wagon, number = seat.split('-')
-            props = self.seat_properties.get(seat, [])
-            is_class1 = "CLASS_1" in props
+        for wagon in sorted(self.all_wagons, key=int):
+            seats = sorted((seat for seat in table.keys() if seat.split('-')[0] == wagon), key=seat_sort_key)
+            self._seat_rows[wagon] = (row_idx, seats)
+            row_idx += len(seats)
+        self._sync_wagons()
+    def _sync_wagons(self):
+        """Pokazuje wiersze rozwiniętych wagonów (budując je przy pierwszym rozwinięciu) i ukrywa pozostałe."""
+        for wagon, chip in self._chips.items():
+            expanded = wagon in self.selected_wagons
+            chip.configure(
+                fg_color="#1976D2" if expanded else "#B0BEC5",
+                text_color="#fff" if expanded else "#263238"
+            )
+            if wagon in self._wagon_labels:
+                self._wagon_labels[wagon].configure(text=f"{'▾' if expanded else '▸'} Wagon {wagon}")
+            if expanded:
+                if wagon in self._row_cache:
+                    for widget in self._row_cache[wagon]:
+                        widget.grid()
+                elif wagon in self._seat_rows:
+                    self._row_cache[wagon] = self._build_wagon_rows(wagon)
+            elif wagon in self._row_cache:
+                for widget in self._row_cache[wagon]:
+                    widget.grid_remove()
+    def _build_wagon_rows(self, wagon):
+        widgets = []
+        row_idx, seats = self._seat_rows[wagon]
+        for seat in seats:
+            is_class1 = "CLASS_1" in self.seat_properties.get(seat, [])
             seat_label = ctk.CTkLabel(
                 self.scrollable_frame,
                 text=seat,
@@ -89,33 +151,42 @@ class ResultsViewer(ctk.CTkFrame):
             )
             seat_label.grid(row=row_idx, column=0, padx=5, pady=2)
             seat_label.bind("<Button-1>", lambda e, s=seat: self.show_properties(s))
-            for col_idx, col in enumerate(columns):
-                status = table[seat].get(col, "unknown")
-                color = self._get_status_color(status)
+            widgets.append(seat_label)
+            for col_idx, col in enumerate(self._last_columns):
                 status_label = ctk.CTkLabel(
                     self.scrollable_frame,
                     text="",
-                    fg_color=color,
+                    fg_color=self._get_status_color(self._last_table[seat].get(col, "unknown")),
                     corner_radius=5,
                     width=40,
                     height=25
                 )
                 status_label.grid(row=row_idx, column=col_idx+1, padx=2, pady=2)
+                widgets.append(status_label)
+            row_idx += 1
+        return widgets
     def toggle_wagon_and_refresh(self, wagon):
         if wagon in self.selected_wagons:
             self.selected_wagons.remove(wagon)
         else:
             self.selected_wagons.add(wagon)
-        # Odśwież widok natychmiast
-        self.display_results(self._last_table, self._last_columns, self._last_seat_properties)
+        # Odśwież widok natychmiast - bez przebudowy istniejących widżetów
+        self._sync_wagons()
     def _get_status_color(self, status: str) -> str:
         colors = {
             "AVAILABLE": "#4CAF50",  # Zielony
             "RESERVED": "#F44336",  # Czerwony
             "BLOCKED": "#9E9E9E",   # Szary
+            "NOT_IN_CONSIST": "transparent",  # Wagon poza składem na odcinku
             "unknown": "#E0E0E0"     # Jasnoszary
         }
         return colors.get(status.upper(), colors["unknown"])
+    def _get_summary_color(self, free: int, in_consist: int) -> str:
+        if not in_consist:
+            return "transparent"
+        # Od czerwonego (brak wolnych) do zielonego (wszystkie wolne)
+        ratio = free / in_consist
+        return "#{:02X}{:02X}50".format(int(0xF4 + (0x4C - 0xF4) * ratio), int(0x43 + (0xAF - 0x43) * ratio))
     def show_properties(self, seat):
         props = self.seat_properties.get(seat, [])
         msg = f"Właściwości miejsca {seat}:\n\n" + "\n".join(props) if props else "Brak dodatkowych właściwości."
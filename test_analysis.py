@@ -0,0 +1,31 @@
+from analysis import slice_schema, plan_schema_sections
+
+
+def make_schema():
+    return {
+        'stations': ['1', '2', '3', '4', '5'],
+        'travel_plans': [
+            {'wagon': '1', 'from_epa': '1', 'to_epa': '5'},
+            {'wagon': '2', 'from_epa': '1', 'to_epa': '2'},
+            {'wagon': '3', 'from_epa': '4', 'to_epa': '5'}
+        ]
+    }
+
+
+def test_sliced_plan_skips_wagon_running_outside_range():
+    schema = slice_schema(make_schema(), '3', '4')
+    assert plan_schema_sections(schema, {'2'}) == [{'from': '3', 'to': '4', 'wagons': []}]
+
+
+def test_sliced_plan_keeps_wagons_running_in_range():
+    schema = slice_schema(make_schema(), '2', '5')
+    assert plan_schema_sections(schema) == [
+        {'from': '2', 'to': '3', 'wagons': ['1']},
+        {'from': '3', 'to': '4', 'wagons': ['1']},
+        {'from': '4', 'to': '5', 'wagons': ['1', '3']}
+    ]
+
+
+def test_nested_slice_uses_full_route():
+    schema = slice_schema(slice_schema(make_schema(), '1', '4'), '3', '4')
+    assert plan_schema_sections(schema, {'3'}) == [{'from': '3', 'to': '4', 'wagons': []}]
@@ -1,7 +1,12 @@
 import streamlit as st
-import json
 from bilkom_client import BilkomClient, StationMapper
+from result_store import get_result_store, make_analysis_id
+from analysis import load_schema, run_analysis
+from date_scan import scan_dates, SCAN_NOT_IN_CONSIST, SCAN_NO_BUDGET, SCAN_ERROR
+from prefetch import get_prefetch_scheduler
+from grid_component import build_grid_args, grm_grid
 import streamlit.components.v1 as components
+import time
 
 st.set_page_config(page_title="BILKOM GRM Analyzer", layout="wide")
 
@@ -55,7 +60,29 @@ else:
 
 st.title("BILKOM GRM Analyzer (wersja web)")
 
-station_mapper = StationMapper()
+@st.cache_resource
+def get_station_mapper():
+    # Jedna instancja mapowania na proces - CSV nie jest parsowany przy każdym przebiegu skryptu
+    return StationMapper()
+
+station_mapper = get_station_mapper()
+# Wspólny dla wszystkich sesji magazyn wyników - sesja trzyma tylko identyfikatory
+result_store = get_result_store()
+# Planista rozgrzewający cache popularnych pociągów (jeden na proces, działa w tle)
+prefetch_scheduler = get_prefetch_scheduler()
+
+with st.sidebar.expander("Pamięć wyników"):
+    store_stats = result_store.stats()
+    st.write(f"Analiz w pamięci: {store_stats['entries']}")
+    st.write(f"Zajętość: {store_stats['bytes'] / 1024 / 1024:.1f} / {store_stats['max_bytes'] / 1024 / 1024:.0f} MB ({store_stats['usage']:.0%})")
+    st.write(f"Trafienia/chybienia: {store_stats['hits']}/{store_stats['misses']}, usunięte (LRU): {store_stats['evictions']}")
+
+with st.sidebar.expander("Rozgrzewanie cache"):
+    prefetch_stats = prefetch_scheduler.stats()
+    st.write(f"Śledzone pociągi: {prefetch_stats['tracked']}, rozgrzane: {prefetch_stats['prefetched']}")
+    st.write(f"Zapytania: {prefetch_stats['requests']} (budżet {prefetch_stats['budget_per_hour']}/h)")
+    st.write(f"Cache /grm - trafienia/chybienia: {prefetch_stats['cache']['hits']}/{prefetch_stats['cache']['misses']}")
+    st.write(f"Cache /grm - pamięć: {prefetch_stats['cache']['bytes'] / 1024 / 1024:.1f} / {prefetch_stats['cache']['max_bytes'] / 1024 / 1024:.0f} MB")
 
 def get_station_name(epa_num):
     return station_mapper.epa_to_name.get(epa_num, epa_num)
@@ -73,159 +100,113 @@ components.html(f'''
     <button onclick="navigator.clipboard.writeText(document.querySelector('input[data-testid=\'stTextInput\']').value)" style="margin-left:8px;padding:6px 16px;border-radius:6px;border:1px solid #1976D2;background:#1976D2;color:#fff;cursor:pointer;">Kopiuj</button>
 ''', height=40)
 
-if 'results' not in st.session_state:
-    st.session_state['results'] = None
-    st.session_state['seats_sorted'] = None
-    st.session_state['seat_properties'] = None
-    st.session_state['columns'] = None
-    st.session_state['all_wagons'] = None
+if 'analysis_id' not in st.session_state:
+    st.session_state['analysis_id'] = None
+    st.session_state['schema_id'] = None
+    st.session_state['scan_id'] = None
     st.session_state['show_props'] = None
-    st.session_state['station_info'] = None
+
+def recalc_relation(from_epa, to_epa):
+    # Podmień w linku fromStation i toStation na HAFAS odpowiadające EPA
+    # (callback - ustawiamy stan pola "link" zanim zostanie ponownie utworzone)
+    from_hafas = station_mapper.epa_to_hafas.get(from_epa)
+    to_hafas = station_mapper.epa_to_hafas.get(to_epa)
+    if from_hafas and to_hafas:
+        import re
+        new_link = re.sub(r'(items%5b0%5d.fromStation=)[^&]*', f'\\1{from_hafas}', st.session_state['link'])
+        new_link = re.sub(r'(items%5b0%5d.toStation=)[^&]*', f'\\1{to_hafas}', new_link)
+        st.session_state['link'] = new_link
 
 if st.button("Analizuj miejsca"):
-    bilkom = BilkomClient()
+    bilkom = prefetch_scheduler.make_client()
     params = bilkom.parse_url(link)
-    if not all([params['from_station'], params['to_station'], params['date'], params['train_number']]):
-        st.error(f"Brak wymaganych parametrów w linku: {params}")
-        st.stop()
-    stations, stops, req1, resp1 = bilkom.get_train_stations(
-        params['from_station'],
-        params['to_station'],
-        params['train_number'],
-        params['date']
-    )
-    if len(stations) < 2:
-        st.error("Za mało stacji na trasie!")
-        st.stop()
-    # Mapa EPA -> info o stacji
-    station_info = {}
-    for stop in stops:
-        epa = str(stop.get('stationNumber'))
-        station_info[epa] = {
-            'name': get_station_name(epa),
-            'code': epa,
-            'arrival': stop.get('plannedArrivalTime', ''),
-            'departure': stop.get('plannedDepartureTime', '')
-        }
-    # --- PODSUMOWANIE ZAPYTANIA ---
-    if stops and len(stops) > 1:
-        first_stop = stops[0]
-        last_stop = stops[-1]
-        st.session_state['summary'] = {
-            'train_number': params['train_number'],
-            'from_station': str(first_stop.get('stationNumber')),
-            'to_station': str(last_stop.get('stationNumber')),
-            'from_station_name': get_station_name(str(first_stop.get('stationNumber'))),
-            'to_station_name': get_station_name(str(last_stop.get('stationNumber'))),
-            'date': params['date'],
-        }
-    else:
-        st.session_state['summary'] = {
-            'train_number': params['train_number'],
-            'from_station': params['from_station'],
-            'to_station': params['to_station'],
-            'from_station_name': get_station_name(params['from_station']),
-            'to_station_name': get_station_name(params['to_station']),
-            'date': params['date'],
-        }
-    # --- Wyświetlanie listy wagonów z checkboxami i opisem trasy ---
-    schema_json = None
     try:
-        schema_json = json.loads(resp1)
-    except Exception:
-        pass
-    wagons_schema = []
-    if schema_json and 'carriages' in schema_json:
-        for carriage in schema_json['carriages']:
-            wagon_num = str(carriage.get('carriageNumber'))
-            travel_plan = carriage.get('travelPlan', {})
-            from_epa = str(travel_plan.get('fromStationNumber')) if travel_plan else None
-            to_epa = str(travel_plan.get('toStationNumber')) if travel_plan else None
-            wagons_schema.append({
-                'wagon': wagon_num,
-                'from_epa': from_epa,
-                'to_epa': to_epa
-            })
-    # --- Wyświetlanie unikalnych relacji wagonów pod podsumowaniem ---
-    if wagons_schema:
+        schema, req1, resp1 = load_schema(bilkom, station_mapper, params)
+    except ValueError as e:
+        st.error(str(e))
+        st.stop()
+    st.session_state['schema_id'] = result_store.put(make_analysis_id(params, kind="schema"), schema)
+    # Nowy pociąg - domyślnie pobieramy wszystkie wagony
+    st.session_state['wagony_pobierz'] = sorted({p['wagon'] for p in schema['travel_plans']}, key=int)
+    st.session_state['analysis_id'] = None
+    st.session_state['scan_id'] = None
+    st.session_state['show_props'] = None
+
+schema = result_store.get(st.session_state['schema_id'])
+if st.session_state['schema_id'] and schema is None:
+    st.warning("Dane pociągu zostały usunięte z pamięci - kliknij ponownie \"Analizuj miejsca\".")
+    st.session_state['schema_id'] = None
+if schema:
+    params = schema['params']
+    stations = schema['stations']
+    travel_plans = schema['travel_plans']
+    # --- Wyświetlanie unikalnych relacji wagonów ---
+    if travel_plans:
         # Grupowanie wagonów po relacji (from_epa, to_epa)
         relacje = {}
-        for w in wagons_schema:
+        for w in travel_plans:
             key = (w['from_epa'], w['to_epa'])
             if key not in relacje:
                 relacje[key] = []
             relacje[key].append(w['wagon'])
         st.markdown("**Wagony/relacje:**")
-        st.markdown("<table style='width:100%;border-collapse:collapse;'>", unsafe_allow_html=True)
         for (from_epa, to_epa), wagons in relacje.items():
             from_name = get_station_name(from_epa)
             to_name = get_station_name(to_epa)
             wagony_str = ", ".join(sorted(wagons, key=int))
             col1, col2 = st.columns([4,1])
             col1.markdown(f"<b>{from_name}</b> → <b>{to_name}</b> &nbsp;&nbsp; wagony: {wagony_str}", unsafe_allow_html=True)
-            if col2.button(f"Przelicz", key=f"recalc_{from_epa}_{to_epa}"):
-                # Podmień w linku fromStation i toStation na HAFAS odpowiadające EPA
-                mapper = station_mapper
-                from_hafas = mapper.epa_to_hafas.get(from_epa)
-                to_hafas = mapper.epa_to_hafas.get(to_epa)
-                st.write(f"EPA from: {from_epa}, to: {to_epa} | HAFAS from: {from_hafas}, to: {to_hafas}")
-                if from_hafas and to_hafas:
-                    import re
-                    new_link = re.sub(r'(items%5b0%5d.fromStation=)[^&]*', f'\\1{from_hafas}', link)
-                    new_link = re.sub(r'(items%5b0%5d.toStation=)[^&]*', f'\\1{to_hafas}', new_link)
-                    st.write(f"Nowy link: {new_link}")
-                    st.session_state['link'] = new_link
-                    st.experimental_rerun()
-        st.markdown("</table>", unsafe_allow_html=True)
-    results = {}
-    all_seats = set()
-    seat_properties = {}
-    progress_bar = st.progress(0)
-    for i in range(len(stations) - 1):
-        from_epa = stations[i]
-        to_epa = stations[i + 1]
-        seat_status, req2, resp2 = bilkom.get_carriages_for_section(
-            from_epa,
-            to_epa,
-            params['train_number'],
-            params['date']
-        )
-        col_name = f"{from_epa}-{to_epa}"
-        results[col_name] = seat_status
-        all_seats.update(seat_status.keys())
-        # seat_properties zbieramy tylko z pierwszego odcinka
-        if i == 0:
-            try:
-                carriages_json = json.loads(resp2)
-                for carriage in carriages_json.get('carriages', []):
-                    wagon = carriage.get('carriageNumber')
-                    for spot in carriage.get('spots', []):
-                        seat_key = f"{wagon}-{spot.get('number')}"
-                        seat_properties[seat_key] = spot.get('properties', [])
-            except Exception as e:
-                st.warning(f"Błąd dekodowania JSON: {e}")
-        progress_bar.progress((i + 1) / (len(stations) - 1))
-    progress_bar.empty()
-    def seat_sort_key(seat):
-        wagon, number = seat.split('-')
-        return (int(wagon), int(number))
-    seats_sorted = sorted(all_seats, key=seat_sort_key)
-    all_wagons = sorted({seat.split('-')[0] for seat in seats_sorted}, key=int)
-    pretty_columns = []
-    for col in results.keys():
-        epa = col.split('-')[0]
-        info = station_info.get(epa, {'name':epa, 'code':epa, 'arrival':'', 'departure':''})
-        pretty_columns.append(info)
-    st.session_state['results'] = results
-    st.session_state['seats_sorted'] = seats_sorted
-    st.session_state['seat_properties'] = seat_properties
-    st.session_state['columns'] = pretty_columns
-    st.session_state['all_wagons'] = all_wagons
-    st.session_state['show_props'] = None
-    st.session_state['station_info'] = station_info
+            col2.button(f"Przelicz", key=f"recalc_{from_epa}_{to_epa}", on_click=recalc_relation, args=(from_epa, to_epa))
+    # --- Wybór wagonów i plan odcinków do pobrania ---
+    wagon_options = sorted({p['wagon'] for p in travel_plans}, key=int)
+    selected_fetch = None
+    if wagon_options:
+        selected_fetch = set(st.multiselect("Wagony do pobrania:", wagon_options, key="wagony_pobierz"))
+    plan = BilkomClient.plan_sections(stations, travel_plans, selected_fetch)
+    fetch_count = sum(1 for section in plan if section['wagons'] != [])
+    st.caption(f"Odcinki do pobrania: {fetch_count} z {len(plan)} (pozostałe: poza składem wybranych wagonów)")
+    if st.button("Pobierz miejsca", disabled=fetch_count == 0):
+        progress_bar = st.progress(0)
+        def update_progress(done, total, col_name, request):
+            progress_bar.progress(done / total if total else 1.0)
+        analysis_id = make_analysis_id(params, selected_fetch)
+        # Ponowne pobranie tej samej analizy zawsze pyta BILKOM, z pominięciem cache
+        bilkom = prefetch_scheduler.make_client(force_refresh=analysis_id == st.session_state['analysis_id'])
+        analysis = run_analysis(bilkom, schema, selected_fetch, on_section=update_progress)
+        progress_bar.empty()
+        if analysis_id != st.session_state['analysis_id']:
+            # Inny zestaw danych - zwijamy wagony; ponowne pobranie tej samej analizy zachowuje widok
+            st.session_state['wagony'] = []
+        st.session_state['analysis_id'] = result_store.put(analysis_id, analysis)
+        st.session_state['show_props'] = None
+    # --- Skan wielu dat tego samego pociągu ---
+    with st.expander("Skan wielu dat"):
+        scan_col1, scan_col2 = st.columns(2)
+        scan_days = scan_col1.number_input("Liczba dni (od daty z linku):", min_value=1, max_value=31, value=14)
+        scan_budget = scan_col2.number_input("Limit zapytań do API:", min_value=10, max_value=2000, value=400, step=10)
+        if st.button("Skanuj daty"):
+            with st.spinner("Pobieranie danych dla kolejnych dni..."):
+                scan = scan_dates(params, int(scan_days), int(scan_budget), selected_wagons=selected_fetch, mapper=station_mapper)
+            st.session_state['scan_id'] = result_store.put(
+                make_analysis_id(params, selected_fetch, kind="scan", days=int(scan_days)), scan
+            )
+        scan = result_store.get(st.session_state.get('scan_id'))
+        if scan:
+            import pandas as pd
+            # Tekstowe oznaczenia odcinków bez liczby wolnych miejsc
+            markers = {SCAN_NOT_IN_CONSIST: "poza składem", SCAN_NO_BUDGET: "limit zapytań", SCAN_ERROR: "błąd"}
+            rows = {}
+            for day in scan['dates']:
+                label = f"{day['date'][0:2]}.{day['date'][2:4]}.{day['date'][4:8]}"
+                row = {scan['station_info'].get(section.split('-')[0], {}).get('name', section): str(markers.get(free, free))
+                       for section, free in zip(day['sections'], day['free'])}
+                row['min. wolnych'] = str(day['min_free']) if day['min_free'] is not None else "–"
+                rows[label] = row
+            st.caption(f"Wolne miejsca na odcinkach (wiersze: daty). Zapytania: {scan['requests']} / {scan['max_requests']}, tras: {scan['routes']}")
+            st.dataframe(pd.DataFrame.from_dict(rows, orient='index'))
 
-if 'summary' in st.session_state and st.session_state['summary']:
-    s = st.session_state['summary']
+if schema:
+    s = schema['summary']
     st.markdown(f"""
     <div style='border:2px solid #1976D2; border-radius:8px; padding:12px; margin-bottom:18px; background:#f5f8ff;'>
     <b>Podsumowanie trasy:</b><br>
@@ -236,24 +217,11 @@ if 'summary' in st.session_state and st.session_state['summary']:
     </div>
     """, unsafe_allow_html=True)
 
-if st.session_state['results']:
-    results = st.session_state['results']
-    seats_sorted = st.session_state['seats_sorted']
-    seat_properties = st.session_state['seat_properties']
-    columns = st.session_state['columns']
-    all_wagons = st.session_state['all_wagons']
-    station_info = st.session_state['station_info']
-    default_wagons = all_wagons[:1] if all_wagons else []
-    selected_wagons = st.multiselect("Pokaż wagony:", all_wagons, default=default_wagons, key="wagony")
-    seats_sorted = [seat for seat in seats_sorted if seat.split('-')[0] in selected_wagons]
-
-    # Generowanie tabeli HTML
-    html = """
+GRM_TABLE_STYLE = """
     <style>
     .grm-table { border-collapse: collapse; width: 100%; }
     .grm-table th, .grm-table td { border: 1px solid #bbb; padding: 7px 4px; text-align: center; }
     .grm-table th { background: #f5f5f5; font-size: 12px; font-weight: bold; }
-    .grm-dot { width: 18px; height: 18px; border-radius: 50%; display: inline-block; margin: 0 2px; }
     .grm-seat { cursor: pointer; font-weight: bold; }
     .grm-seat.class1 { color: #F44336; }
     .grm-table tbody tr:nth-child(even) { background: #f9f9f9; }
@@ -261,62 +229,63 @@ if st.session_state['results']:
     .grm-table tr { border-bottom: 2px solid #e0e0e0; }
     .grm-table thead th.rotate { height: 110px; min-width: 36px; max-width: 60px; vertical-align: bottom; padding: 2px 2px; }
     .grm-table thead th.rotate > div { transform: rotate(-75deg); font-size: 11px; white-space: normal; overflow: hidden; text-overflow: ellipsis; max-width: 60px; margin: 0 auto; }
+    .grm-heat { font-weight: bold; color: #000; }
     </style>
-    <table class='grm-table'>
-      <thead>
-        <tr>
-          <th>Miejsce</th>"""
+"""
+
+def render_table_header(columns, first_header):
+    html = f"<table class='grm-table'><thead><tr><th>{first_header}</th>"
     for info in columns:
         arrival = info['arrival'][11:16] if info['arrival'] else ""
         departure = info['departure'][11:16] if info['departure'] else ""
         godziny = f"<div style='font-size:10px; font-weight:normal;'>{arrival} / {departure}</div>" if arrival or departure else ""
         # Dodaj tooltip z pełną nazwą stacji
         html += f"<th class='rotate'><div title='{info['name']}'>{info['name']}</div>{godziny}</th>"
-    html += "</tr>\n      </thead>\n      <tbody>"
-    for seat in seats_sorted:
-        props = seat_properties.get(seat, [])
-        is_class1 = "CLASS_1" in props
-        seat_class = "grm-seat class1" if is_class1 else "grm-seat"
-        html += f"<tr><td class='{seat_class}' onclick=\"window.location.hash='seat_{seat}'\">{seat}</td>"
-        for col_idx, info in enumerate(columns):
-            epa_num = info['code']
-            col_key = None
-            for k in results.keys():
-                if k.startswith(epa_num+"-"):
-                    col_key = k
-                    break
-            status = results[col_key].get(seat, "unknown") if col_key else "unknown"
-            color = {"AVAILABLE": "#4CAF50", "RESERVED": "#F44336", "BLOCKED": "#9E9E9E", "unknown": "#E0E0E0"}.get(status.upper(), "#E0E0E0")
-            html += f"<td><span class='grm-dot' style='background:{color}'></span></td>"
+    return html + "</tr></thead><tbody>"
+
+def render_wagon_heatmap(analysis):
+    # Podsumowanie: liczba wolnych miejsc na wagon x odcinek (kolor wg odsetka wolnych)
+    summary = analysis['wagon_summary']
+    html = render_table_header(analysis['columns'], "Wagon")
+    for wagon, wagon_counts in zip(summary['wagons'], summary['counts']):
+        html += f"<tr><td class='grm-seat'>{wagon}</td>"
+        for free, reserved, blocked, not_in_consist, unknown in wagon_counts:
+            in_consist = free + reserved + blocked + unknown
+            if in_consist == 0:
+                html += "<td title='Wagon poza składem na tym odcinku'>–</td>"
+                continue
+            ratio = free / in_consist
+            html += (f"<td class='grm-heat' style='background:hsl({int(120 * ratio)},65%,65%)' "
+                     f"title='wolne: {free}, zarezerwowane: {reserved}, zablokowane: {blocked}'>{free}</td>")
         html += "</tr>"
-    html += "</tbody></table>"
-    st.markdown(html, unsafe_allow_html=True)
+    return html + "</tbody></table>"
+
+analysis = result_store.get(st.session_state['analysis_id'])
+if st.session_state['analysis_id'] and analysis is None:
+    st.warning("Wyniki analizy zostały usunięte z pamięci - kliknij ponownie \"Pobierz miejsca\".")
+    st.session_state['analysis_id'] = None
+if analysis:
+    seat_properties = analysis['seat_properties']
+    columns = analysis['columns']
+    all_wagons = analysis['all_wagons']
+    data_age = int(time.time() - analysis['fetched_at'])
+    st.caption(f"Dane z {time.strftime('%H:%M:%S', time.localtime(analysis['fetched_at']))} ({data_age} s temu) - "
+               "kliknij ponownie \"Pobierz miejsca\", aby odświeżyć.")
+    st.markdown("**Wolne miejsca na wagon i odcinek:**")
+    st.markdown(GRM_TABLE_STYLE + render_wagon_heatmap(analysis), unsafe_allow_html=True)
+    # Szczegóły miejsc tylko dla rozwiniętych wagonów - rysowane w przeglądarce ze spakowanych statusów;
+    # przy zmianie filtra lub ponownym pobraniu wysyłamy tylko zmienione komórki
+    selected_wagons = st.multiselect("Rozwiń wagony (miejsca):", all_wagons, default=[], key="wagony")
+    grid_value = st.session_state.get('grm_grid') or {}
+    grid_args, st.session_state['grid_state'] = build_grid_args(
+        st.session_state.get('grid_state'), st.session_state['analysis_id'], analysis, grid_value.get('ack')
+    )
+    grid_value = grm_grid(grid_args, selected_wagons) or {}
 
-    # Wyświetlanie właściwości miejsca po kliknięciu (hash w URL)
-    components.html("""
-    <script>
-    window.addEventListener('hashchange', function() {
-      const hash = window.location.hash;
-      if(hash.startsWith('#seat_')) {
-        const seat = hash.replace('#seat_', '');
-        window.parent.postMessage({seat: seat}, '*');
-      }
-    });
-    </script>
-    """, height=0)
-    import streamlit as st2
+    # Właściwości miejsca klikniętego w tabeli
     if 'show_props' not in st.session_state:
         st.session_state['show_props'] = None
-    import streamlit_javascript as st_js
-    seat_clicked = st_js.st_javascript("""
-    function getSeatFromHash() {
-      if(window.location.hash.startsWith('#seat_')) {
-        return window.location.hash.replace('#seat_', '');
-      }
-      return '';
-    }
-    getSeatFromHash();
-    """)
+    seat_clicked = grid_value.get('seat')
     if seat_clicked and seat_clicked in seat_properties:
         props = seat_properties.get(seat_clicked, [])
         st.info(f"Właściwości miejsca {seat_clicked}:\n\n" + "\n".join([f"- {p}" for p in props]) if props else "Brak dodatkowych właściwości.") 
\ No newline at end of file